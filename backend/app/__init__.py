@@ -1,30 +1,111 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from celery import Celery, Task
 from celery.schedules import crontab
-from werkzeug.security import generate_password_hash
+from sqlalchemy.schema import CreateIndex
+from .caching import TieredCache
+from .compression import init_compression
+from .database import RoutingSession, configure_database, init_engines
+from .holds import SlotHolds
+from .metrics import RequestMetrics
+from .passwords import PasswordVerifier, hash_password
 
 # Initialize Extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 cache = Cache()
+tiered_cache = TieredCache()
+password_verifier = PasswordVerifier()
+slot_holds = SlotHolds()
+metrics = RequestMetrics()
 
-def create_app():
+def create_app(config=None):
+    """Builds the app. `config` overrides the defaults below (used by benchmarks and tooling)."""
     app = Flask(__name__)
     
     # Core Configuration
     app.config['SECRET_KEY'] = 'dev-secret-key-required'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///hospital.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Database engines (see app/database.py). An optional read replica serves GET handlers.
+    app.config['DATABASE_READ_URL'] = os.environ.get('DATABASE_READ_URL')
+    if 'DATABASE_READ_ROUTING' in os.environ:
+        app.config['DATABASE_READ_ROUTING'] = os.environ['DATABASE_READ_ROUTING'].lower() in ('1', 'true', 'yes')
+    app.config['DATABASE_READ_MAX_LAG'] = int(os.environ.get('DATABASE_READ_MAX_LAG', 120))  # Seconds; staler replicas are skipped
+    app.config['DATABASE_READ_LAG_CHECK_INTERVAL'] = 5
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # Safe with WAL
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))  # Server databases only
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # Cancel all but the earliest of duplicate active bookings so uq_appointment_active_slot
+    # can be created on old data (otherwise startup fails and lists them)
+    app.config['DEDUPE_ACTIVE_BOOKINGS'] = os.environ.get('DEDUPE_ACTIVE_BOOKINGS', '').lower() in ('1', 'true', 'yes')
+
+    # Generated artifacts (monthly reports, patient exports)
+    app.config['REPORTS_DIR'] = os.path.join(app.instance_path, 'reports')
+    app.config['EXPORT_DIR'] = os.path.join(app.instance_path, 'exports')
+    app.config['EXPORT_TTL'] = 7 * 24 * 3600  # How long export task records are kept
+
+    # Password hashing: method string with explicit cost, tunable without forcing resets
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_SALT_LENGTH'] = 16
+    app.config['PASSWORD_VERIFY_WORKERS'] = os.cpu_count()  # Login verification threads
+    app.config['PASSWORD_VERIFY_QUEUE'] = 64  # Logins allowed to wait before 503s
+    app.config['PASSWORD_VERIFY_TIMEOUT'] = 10
+
+    # Seconds a resolved Doctor/Patient profile is reused across requests (0 disables)
+    app.config['PROFILE_CACHE_TTL'] = 30
+
+    # Bulk import: password hashing processes (None = CPU count)
+    app.config['IMPORT_HASH_WORKERS'] = None
+
     # Redis, Celery & Caching Configuration
     app.config['CELERY_BROKER_URL'] = 'redis://localhost:6379/0'
     app.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379/0'
     app.config['CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP'] = True # Fixes the warning you saw
+    # Publishing from a request gives up after one quick retry instead of ~6s of back-off when the
+    # broker is down (workers reconnect with their own broker_connection_max_retries)
+    app.config['CELERY_BROKER_TRANSPORT_OPTIONS'] = {'max_retries': 1, 'interval_start': 0, 'interval_step': 0.2}
     
     app.config['CACHE_TYPE'] = 'RedisCache'
     app.config['CACHE_REDIS_URL'] = 'redis://localhost:6379/1'
     app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+
+    # Versioned two-tier cache (per-process LRU in front of Redis)
+    app.config['CACHE_VERSIONED_TIMEOUT'] = 3600  # Entries are invalidated by version bumps, not expiry
+    app.config['CACHE_VERSION_TTL'] = 5  # Seconds other processes may serve a superseded version
+    app.config['CACHE_LOCAL_MAX_ENTRIES'] = 256
+    app.config['CACHE_LOCAL_MAX_BYTES'] = 8 * 1024 * 1024
+
+    # Booking rushes (app/holds.py): store defaults to Redis when the cache is Redis, else in-memory
+    app.config['SLOT_HOLD_BACKEND'] = os.environ.get('SLOT_HOLD_BACKEND')  # 'redis' or 'memory'
+    app.config['SLOT_HOLD_REDIS_URL'] = os.environ.get('SLOT_HOLD_REDIS_URL')  # Defaults to CACHE_REDIS_URL
+    app.config['SLOT_HOLD_TTL'] = 30  # Seconds a booking attempt keeps competitors away from the slot
+    app.config['SLOT_OFFER_TTL'] = 600  # Seconds a freed slot stays reserved for the first waitlisted patient
+    app.config['SLOT_OFFER_NOTIFY'] = None  # Queue offer notifications (None: only with the Redis store)
+
+    # Request instrumentation (Server-Timing header, slow logs, /admin/metrics)
+    app.config['METRICS_ENABLED'] = True
+    app.config['SERVER_TIMING_HEADER'] = True
+    app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+
+    # JSON/NDJSON responses: negotiated br/gzip compression, streaming batch size
+    app.config['COMPRESS_ENABLED'] = True
+    app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    app.config['COMPRESS_LEVEL'] = 6  # gzip
+    app.config['COMPRESS_BR_QUALITY'] = 4  # brotli; higher levels cost far more CPU per response
+    app.config['STREAM_BATCH_SIZE'] = 1000  # Rows fetched and encoded per NDJSON chunk
+
+    # POST /auth/bundle: sub-requests per bundle, threads answering them (1 = in order)
+    app.config['BUNDLE_MAX_REQUESTS'] = 10
+    app.config['BUNDLE_WORKERS'] = int(os.environ.get('BUNDLE_WORKERS', 4))
     
     # Scheduled Jobs Configuration
     app.config['CELERY_BEAT_SCHEDULE'] = {
@@ -32,21 +113,47 @@ def create_app():
             'task': 'app.tasks.send_daily_reminders',
             'schedule': crontab(hour=8, minute=0), # Runs daily at 8:00 AM
         },
+        'reoffer-expired-slots': {
+            'task': 'app.tasks.reoffer_expired_slots',
+            'schedule': crontab(), # Runs every minute
+        },
+        'replica-heartbeat': {
+            'task': 'app.tasks.replica_heartbeat',
+            'schedule': crontab(), # Runs every minute
+        },
+        'reconcile-stat-counters': {
+            'task': 'app.tasks.reconcile_stat_counters',
+            'schedule': crontab(minute=0), # Runs hourly
+        },
         'monthly-reports': {
             'task': 'app.tasks.generate_monthly_reports',
             'schedule': crontab(day_of_month=1, hour=9, minute=0), # Runs 1st of month at 9:00 AM
         },
     }
 
+    if config:
+        app.config.update(config)
+
     # Init Extensions
+    configure_database(app)
     db.init_app(app)
+    init_engines(app, db)
     cache.init_app(app)
+    tiered_cache.init_app(app, cache)
+    password_verifier.init_app(app)
+    slot_holds.init_app(app)
+    metrics.init_app(app, cache)
+    init_compression(app)  # Registered last so it runs first and metrics see compressed sizes
     
     # Initialize Celery
     app.extensions['celery'] = celery_init_app(app)
 
     # Import models explicitly
-    from .models import User, Doctor, Patient, Department, Appointment, Treatment
+    from .models import User, Doctor, DoctorAvailability, Patient, Department, Appointment, Treatment, StatCounter
+    from .slots import migrate_legacy_schedules
+    from .stats import reconcile_counters
+    from .queries import duplicate_active_slots, cancel_duplicate_bookings
+    from .search import ensure_search_index
     
     # Register Blueprints
     from .api.auth import auth_bp
@@ -59,12 +166,42 @@ def create_app():
     app.register_blueprint(doctor_bp, url_prefix='/doctor')
     app.register_blueprint(patient_bp, url_prefix='/patient')
 
+    # CLI Commands
+    from .commands import import_users_command, seed_command, sync_replica_command
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(sync_replica_command)
+
     with app.app_context():
         db.create_all()
 
+        # The unique slot index cannot be built while old data double-books a slot
+        duplicates = duplicate_active_slots()
+        if duplicates and app.config['DEDUPE_ACTIVE_BOOKINGS']:
+            cancelled = cancel_duplicate_bookings()
+            reconcile_counters()
+            app.logger.warning(f"Cancelled duplicate active bookings: appointment ids {cancelled}")
+        elif duplicates:
+            slots = '; '.join(f"doctor {doctor_id} on {day} at {time_slot}: appointments {ids}"
+                              for doctor_id, day, time_slot, ids in duplicates)
+            app.logger.error(f"Slots with more than one active booking: {slots}")
+            raise RuntimeError("Cannot create uq_appointment_active_slot while slots are double-booked; "
+                               "cancel the extra bookings or start once with DEDUPE_ACTIVE_BOOKINGS=1")
+
+        # create_all() skips indexes on tables that already exist, so backfill them
+        # (IF NOT EXISTS: checkfirst cannot see SQLite expression indexes)
+        with db.engine.begin() as connection:
+            for index in [*User.__table__.indexes, *Appointment.__table__.indexes]:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+        # Move legacy JSON availability into DoctorAvailability rows
+        migrated = migrate_legacy_schedules()
+        if migrated:
+            print(f"Migrated availability for {migrated} doctors.")
+
         # Admin Seeding
         if not User.query.filter_by(role='admin').first():
-            hashed_password = generate_password_hash('admin123')
+            hashed_password = hash_password('admin123')
             new_admin = User(email='admin@hospital.com', password=hashed_password, role='admin', is_active=True)
             db.session.add(new_admin)
             db.session.commit()
@@ -78,6 +215,13 @@ def create_app():
             db.session.commit()
             print("Departments seeded.")
 
+        # Directory search index (SQLite FTS5), built on first run
+        ensure_search_index()
+
+        # First run (or counters table newly added): build dashboard counters from scratch
+        if not StatCounter.query.first():
+            reconcile_counters()
+
     return app
 
 def celery_init_app(app: Flask) -> Celery:
@@ -93,6 +237,7 @@ def celery_init_app(app: Flask) -> Celery:
         broker_url=app.config['CELERY_BROKER_URL'],
         result_backend=app.config['CELERY_RESULT_BACKEND'],
         beat_schedule=app.config['CELERY_BEAT_SCHEDULE'],
+        broker_transport_options=app.config['CELERY_BROKER_TRANSPORT_OPTIONS'],
         broker_connection_retry_on_startup=True
     )
     # ---------------------------------------------------
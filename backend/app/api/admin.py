@@ -1,17 +1,28 @@
-from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash
-from ..models import db, User, Doctor, Patient, Appointment, Department, Treatment
-from .decorators import admin_required
+import io
+from flask import Blueprint, request, jsonify, current_app
+from datetime import datetime
+from sqlalchemy import and_, or_, func
+from ..models import db, User, Doctor, DoctorPurge, Patient, Appointment, Department, Treatment
+from .decorators import admin_required, query_budget, invalidate_profile
+from ..bulk_import import IMPORT_KINDS, detect_format, import_users
+from ..passwords import hash_password
+from ..queries import completed_history_query, pending_purge_ids
+from ..search import search_ids, search_page_args, in_rank_order, index_entities, remove_entities
+from ..tasks import purge_doctor, purge_is_alive
+from .. import metrics, slot_holds, tiered_cache
+from ..caching import appointment_namespaces, patient_namespaces
+from ..stats import adjust_counters, record_appointment_change, read_dashboard_stats
+from ..serialization import json_response, ndjson_response, records, wants_ndjson
+from ..utils import parse_date, parse_limit, encode_cursor, decode_cursor
 
 admin_bp = Blueprint('admin', __name__)
 
 @admin_bp.route('/dashboard', methods=['GET'])
 @admin_required
+@query_budget(1)
 def dashboard():
-    doctor_count = Doctor.query.count()
-    patient_count = Patient.query.count()
-    appointment_count = Appointment.query.count()
-    return jsonify({'stats': {'doctors': doctor_count, 'patients': patient_count, 'appointments': appointment_count}}), 200
+    # Served from incrementally maintained counters (see app/stats.py)
+    return jsonify({'stats': read_dashboard_stats()}), 200
 
 @admin_bp.route('/departments', methods=['GET'])
 @admin_required
@@ -22,20 +33,50 @@ def get_departments():
 
 @admin_bp.route('/doctors', methods=['GET'])
 @admin_required
+@tiered_cache.conditional('doctors')
+@query_budget(1)
 def get_all_doctors():
-    doctors = Doctor.query.all()
-    output = []
-    for doc in doctors:
-        output.append({
-            'id': doc.id,
-            'name': doc.name,
-            'email': doc.user.email,
-            'specialization_id': doc.specialization_id,
-            'specialization': doc.department.name if doc.department else 'N/A',
-            'is_approved': doc.is_approved,
-            'active': doc.user.is_active
-        })
-    return jsonify(output), 200
+    """All doctors; streamed as NDJSON with ?stream=1 or Accept: application/x-ndjson."""
+    query = db.session.query(
+        Doctor.id, Doctor.name, User.email, Doctor.specialization_id,
+        func.coalesce(Department.name, 'N/A'), Doctor.is_approved, User.is_active
+    ).join(User, Doctor.user_id == User.id) \
+     .outerjoin(Department, Doctor.specialization_id == Department.id) \
+     .filter(Doctor.id.not_in(pending_purge_ids()))
+    fields = ('id', 'name', 'email', 'specialization_id', 'specialization', 'is_approved', 'active')
+    if wants_ndjson():
+        return ndjson_response(query.order_by(Doctor.id), fields)
+    return json_response(records(query.all(), fields))
+
+@admin_bp.route('/doctors/search', methods=['GET'])
+@admin_required
+@query_budget(3)
+def search_doctors():
+    """Ranked, typo-tolerant search over doctor names, emails and departments."""
+    try:
+        q, limit, offset, mode = search_page_args(request.args)
+    except ValueError:
+        return jsonify({'message': 'Invalid pagination parameters'}), 400
+
+    ids, mode = search_ids('doctor', q, limit, offset, mode)
+    rows = db.session.query(
+        Doctor.id, Doctor.name, Doctor.specialization_id, Doctor.is_approved,
+        User.email, User.is_active, Department.name.label('department_name')
+    ).join(User, Doctor.user_id == User.id) \
+     .outerjoin(Department, Doctor.specialization_id == Department.id) \
+     .filter(Doctor.id.in_(ids)).all() if ids else []
+
+    output = [{
+        'id': doc.id,
+        'name': doc.name,
+        'email': doc.email,
+        'specialization_id': doc.specialization_id,
+        'specialization': doc.department_name or 'N/A',
+        'is_approved': doc.is_approved,
+        'active': doc.is_active
+    } for doc in in_rank_order(rows, ids)]
+    next_offset = offset + limit if len(ids) == limit else None
+    return jsonify({'results': output, 'mode': mode, 'next_offset': next_offset}), 200
 
 @admin_bp.route('/doctors', methods=['POST'])
 @admin_required
@@ -48,19 +89,49 @@ def add_doctor():
         return jsonify({'message': 'Email already registered'}), 409
 
     try:
-        hashed_pw = generate_password_hash(data['password'])
+        hashed_pw = hash_password(data['password'])
         new_user = User(email=data['email'], password=hashed_pw, role='doctor', is_active=True)
         db.session.add(new_user)
         db.session.flush()
 
         new_doctor = Doctor(user_id=new_user.id, name=data['name'], specialization_id=data['specialization_id'], is_approved=True)
         db.session.add(new_doctor)
+        db.session.flush()
+        index_entities('doctor', [new_doctor.id])
+        adjust_counters({'doctors': 1})
         db.session.commit()
+        tiered_cache.bump_version('doctors')
         return jsonify({'message': 'Doctor added successfully'}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': str(e)}), 500
 
+@admin_bp.route('/import/<kind>', methods=['POST'])
+@admin_required
+def bulk_import(kind):
+    """
+    Bulk-creates doctors or patients from CSV or NDJSON, sent as a multipart 'file'
+    upload or as the raw request body. Format comes from ?format=, the file extension
+    or the content type. Returns per-row errors instead of failing the whole import.
+    """
+    if kind not in IMPORT_KINDS:
+        return jsonify({'message': 'Import kind must be doctors or patients'}), 404
+
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = detect_format(upload.filename, upload.mimetype, request.args.get('format'))
+    else:
+        stream = io.BufferedReader(request.stream)
+        fmt = detect_format(None, request.mimetype, request.args.get('format'))
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'message': 'Format must be csv or ndjson'}), 400
+
+    report = import_users(kind, stream, fmt, current_app.config.get('IMPORT_HASH_WORKERS'))
+    if report['created']:
+        tiered_cache.bump_version(kind)
+    return jsonify(report), 200
+
 @admin_bp.route('/doctors/<int:doctor_id>', methods=['PUT'])
 @admin_required
 def update_doctor(doctor_id):
@@ -70,36 +141,65 @@ def update_doctor(doctor_id):
     data = request.get_json()
     if 'name' in data: doctor.name = data['name']
     if 'specialization_id' in data: doctor.specialization_id = data['specialization_id']
+    index_entities('doctor', [doctor.id])
     
     db.session.commit()
+    invalidate_profile('doctor', doctor_id)
+    tiered_cache.bump_version('doctors')
     return jsonify({'message': 'Doctor updated successfully'}), 200
 
-# --- FIX: Cascading Delete ---
+# --- Soft Delete + Background Purge ---
 @admin_bp.route('/doctors/<int:doctor_id>', methods=['DELETE'])
 @admin_required
 def delete_doctor(doctor_id):
+    """
+    Deactivates the doctor immediately (hidden from patients and the admin roster, login
+    blocked) and schedules purge_doctor to remove their data in the background.
+    Re-issuing the DELETE re-dispatches a purge that is pending, failed, or 'running'
+    without a recent heartbeat (its worker died).
+    """
     doctor = Doctor.query.get(doctor_id)
     if not doctor: return jsonify({'message': 'Doctor not found'}), 404
-    
-    # 1. Delete associated appointments and treatments
-    appointments = Appointment.query.filter_by(doctor_id=doctor.id).all()
-    for apt in appointments:
-        if apt.treatment:
-            db.session.delete(apt.treatment)
-        db.session.delete(apt)
-    
-    # 2. Delete User account
-    user = doctor.user
-    db.session.delete(doctor)
-    if user:
-        db.session.delete(user)
-        
+
+    purge = db.session.get(DoctorPurge, doctor_id)
+    if purge and purge.status == 'running' and purge_is_alive(doctor_id):
+        return jsonify({'message': 'Doctor deletion already in progress'}), 409
+
+    doctor.is_approved = False
+    doctor.user.is_active = False
+    remove_entities('doctor', [doctor_id])
+    purge = db.session.merge(DoctorPurge(doctor_id=doctor_id, status='pending', total=0, deleted=0,
+                                         requested_at=datetime.utcnow(), finished_at=None))
     try:
         db.session.commit()
-        return jsonify({'message': 'Doctor deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': str(e)}), 500
+    tiered_cache.bump_version('doctors')
+    invalidate_profile('doctor', doctor_id)
+
+    try:
+        # No publish retries or result tracking (progress lives in DoctorPurge): a broker
+        # outage must not hold the request for seconds
+        purge_doctor.apply_async((doctor_id,), retry=False, ignore_result=True)
+    except Exception as e:
+        # The doctor stays deactivated; the purge can be re-dispatched with another DELETE
+        current_app.logger.error(f"Could not schedule purge for doctor {doctor_id}: {e}")
+        return jsonify({'message': 'Doctor deactivated; purge could not be scheduled, retry later'}), 202
+    return jsonify({'message': 'Doctor deleted successfully'}), 202
+
+@admin_bp.route('/doctors/<int:doctor_id>/purge', methods=['GET'])
+@admin_required
+def doctor_purge_status(doctor_id):
+    purge = db.session.get(DoctorPurge, doctor_id)
+    if not purge: return jsonify({'message': 'No deletion requested'}), 404
+    return jsonify({
+        'status': purge.status,
+        'deleted': purge.deleted,
+        'total': purge.total,
+        'requested_at': purge.requested_at.isoformat() if purge.requested_at else None,
+        'finished_at': purge.finished_at.isoformat() if purge.finished_at else None
+    }), 200
 # -----------------------------
 
 @admin_bp.route('/doctors/<int:doctor_id>/status', methods=['PUT'])
@@ -107,6 +207,8 @@ def delete_doctor(doctor_id):
 def update_doctor_status(doctor_id):
     doctor = Doctor.query.get(doctor_id)
     if not doctor: return jsonify({'message': 'Doctor not found'}), 404
+    purge = db.session.get(DoctorPurge, doctor_id)
+    if purge and purge.status != 'done': return jsonify({'message': 'Doctor is being deleted'}), 409
     
     is_approved = request.json.get('is_approved')
     if is_approved is None: return jsonify({'message': 'Status required'}), 400
@@ -114,21 +216,68 @@ def update_doctor_status(doctor_id):
     doctor.is_approved = is_approved
     doctor.user.is_active = is_approved
     db.session.commit()
+    tiered_cache.bump_version('doctors')
+    invalidate_profile('doctor', doctor_id)
     return jsonify({'message': 'Status updated'}), 200
 
+@admin_bp.route('/cache/stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Hit/miss counters for the local and Redis cache tiers of this process."""
+    return jsonify(tiered_cache.stats()), 200
+
+@admin_bp.route('/metrics', methods=['GET'])
+@admin_required
+def prometheus_metrics():
+    """Request, SQL and cache metrics of this process in Prometheus text format."""
+    body = metrics.render(tiered_cache.stats())
+    return current_app.response_class(body, mimetype='text/plain; version=0.0.4')
+
 @admin_bp.route('/patients', methods=['GET'])
 @admin_required
+@tiered_cache.conditional('patients', 'appointments')
+@query_budget(1)
 def get_all_patients():
-    patients = Patient.query.all()
+    """All patients with appointment counts; streamed as NDJSON like get_all_doctors."""
+    # Appointment counts come from a grouped subquery instead of loading every appointment
+    counts = db.session.query(
+        Appointment.patient_id, func.count(Appointment.id).label('appointment_count')
+    ).group_by(Appointment.patient_id).subquery()
+
+    query = db.session.query(
+        Patient.id, Patient.name, User.email, Patient.contact_info, Patient.is_blocked,
+        func.coalesce(counts.c.appointment_count, 0)
+    ).join(User, Patient.user_id == User.id) \
+     .outerjoin(counts, counts.c.patient_id == Patient.id)
+    fields = ('id', 'name', 'email', 'contact_info', 'is_blocked', 'appointment_count')
+    if wants_ndjson():
+        return ndjson_response(query.order_by(Patient.id), fields)
+    return json_response(records(query.all(), fields))
+
+@admin_bp.route('/patients/search', methods=['GET'])
+@admin_required
+@query_budget(3)
+def search_patients():
+    """Ranked, typo-tolerant search over patient names and emails. Pages with limit/offset."""
+    try:
+        q, limit, offset, mode = search_page_args(request.args)
+    except ValueError:
+        return jsonify({'message': 'Invalid pagination parameters'}), 400
+
+    ids, mode = search_ids('patient', q, limit, offset, mode)
+    rows = db.session.query(
+        Patient.id, Patient.name, Patient.contact_info, Patient.is_blocked, User.email
+    ).join(User, Patient.user_id == User.id).filter(Patient.id.in_(ids)).all() if ids else []
+
     output = [{
         'id': p.id,
         'name': p.name,
-        'email': p.user.email,
+        'email': p.email,
         'contact_info': p.contact_info,
-        'is_blocked': p.is_blocked,
-        'appointment_count': len(p.appointments)
-    } for p in patients]
-    return jsonify(output), 200
+        'is_blocked': p.is_blocked
+    } for p in in_rank_order(rows, ids)]
+    next_offset = offset + limit if len(ids) == limit else None
+    return jsonify({'results': output, 'mode': mode, 'next_offset': next_offset}), 200
 
 @admin_bp.route('/patients/<int:patient_id>', methods=['PUT'])
 @admin_required
@@ -139,8 +288,11 @@ def update_patient(patient_id):
     data = request.get_json()
     if 'name' in data: patient.name = data['name']
     if 'contact_info' in data: patient.contact_info = data['contact_info']
+    index_entities('patient', [patient.id])
     
     db.session.commit()
+    invalidate_profile('patient', patient_id)
+    tiered_cache.bump_version(*patient_namespaces(patient_id))
     return jsonify({'message': 'Patient updated'}), 200
 
 @admin_bp.route('/patients/<int:patient_id>/block', methods=['PUT'])
@@ -152,42 +304,88 @@ def block_patient(patient_id):
     is_blocked = request.json.get('is_blocked')
     patient.is_blocked = is_blocked
     db.session.commit()
+    tiered_cache.bump_version(*patient_namespaces(patient_id))
     return jsonify({'message': 'Status updated'}), 200
 
 # --- NEW: Admin View Patient History ---
 @admin_bp.route('/patients/<int:patient_id>/history', methods=['GET'])
 @admin_required
+@query_budget(2)
 def get_patient_history(patient_id):
     """View past treatments of a specific patient"""
-    patient = Patient.query.get(patient_id)
-    if not patient: return jsonify({'message': 'Patient not found'}), 404
+    if not db.session.query(Patient.id).filter_by(id=patient_id).scalar():
+        return jsonify({'message': 'Patient not found'}), 404
 
-    history = Appointment.query.filter_by(patient_id=patient_id, status='Completed').all()
-    output = []
-    for apt in history:
-        if apt.treatment:
-            output.append({
-                'date': apt.date.isoformat(),
-                'doctor_name': apt.doctor.name,
-                'diagnosis': apt.treatment.diagnosis,
-                'prescription': apt.treatment.prescription
-            })
-    return jsonify(output), 200
+    rows = completed_history_query(patient_id).with_entities(
+        Appointment.date, Doctor.name, Treatment.diagnosis, Treatment.prescription).all()
+    return json_response(records(rows, ('date', 'doctor_name', 'diagnosis', 'prescription')))
 # ---------------------------------------
 
 @admin_bp.route('/appointments', methods=['GET'])
 @admin_required
+@query_budget(1)
 def view_all_appointments():
-    appointments = Appointment.query.order_by(Appointment.date.desc()).all()
-    output = [{
-        'id': apt.id,
-        'patient_name': apt.patient.name,
-        'doctor_name': apt.doctor.name,
-        'date': apt.date.isoformat(),
-        'time_slot': apt.time_slot,
-        'status': apt.status
-    } for apt in appointments]
-    return jsonify(output), 200
+    """
+    Keyset-paginated appointment listing ordered by (date, id).
+    Query args: status, doctor_id, patient_id, date_from, date_to (YYYY-MM-DD),
+    order ('desc' default or 'asc'), limit (max 200) and cursor (from the previous page).
+    In NDJSON mode (?stream=1 or Accept: application/x-ndjson) every matching row after
+    the cursor is streamed in order and limit does not apply.
+    """
+    args = request.args
+    descending = args.get('order', 'desc') != 'asc'
+
+    try:
+        limit = parse_limit(args.get('limit'))
+        date_from = parse_date(args['date_from']) if args.get('date_from') else None
+        date_to = parse_date(args['date_to']) if args.get('date_to') else None
+        doctor_id = int(args['doctor_id']) if args.get('doctor_id') else None
+        patient_id = int(args['patient_id']) if args.get('patient_id') else None
+        cursor = None
+        if args.get('cursor'):
+            cursor_date, cursor_id = decode_cursor(args['cursor'])
+            cursor = (parse_date(cursor_date), int(cursor_id))
+    except ValueError:
+        return jsonify({'message': 'Invalid pagination or filter parameters'}), 400
+
+    # Names are joined in so the page is built from a single query
+    query = db.session.query(
+        Appointment.id, Appointment.date, Appointment.time_slot, Appointment.status,
+        Patient.name.label('patient_name'), Doctor.name.label('doctor_name')
+    ).join(Patient, Appointment.patient_id == Patient.id) \
+     .join(Doctor, Appointment.doctor_id == Doctor.id)
+
+    if args.get('status'): query = query.filter(Appointment.status == args['status'])
+    if doctor_id is not None: query = query.filter(Appointment.doctor_id == doctor_id)
+    if patient_id is not None: query = query.filter(Appointment.patient_id == patient_id)
+    if date_from: query = query.filter(Appointment.date >= date_from)
+    if date_to: query = query.filter(Appointment.date <= date_to)
+
+    if cursor:
+        cursor_date, cursor_id = cursor
+        if descending:
+            query = query.filter(or_(Appointment.date < cursor_date,
+                                     and_(Appointment.date == cursor_date, Appointment.id < cursor_id)))
+        else:
+            query = query.filter(or_(Appointment.date > cursor_date,
+                                     and_(Appointment.date == cursor_date, Appointment.id > cursor_id)))
+
+    if descending:
+        query = query.order_by(Appointment.date.desc(), Appointment.id.desc())
+    else:
+        query = query.order_by(Appointment.date.asc(), Appointment.id.asc())
+
+    fields = ('id', 'date', 'time_slot', 'status', 'patient_name', 'doctor_name')
+    if wants_ndjson():
+        return ndjson_response(query, fields)
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = encode_cursor(rows[-1].date, rows[-1].id) if has_more else None
+    return json_response({'appointments': records(rows, fields), 'next_cursor': next_cursor})
 
 @admin_bp.route('/appointments/<int:id>/cancel', methods=['PUT'])
 @admin_required
@@ -195,6 +393,11 @@ def cancel_appointment(id):
     appt = Appointment.query.get(id)
     if not appt: return jsonify({'message': 'Not found'}), 404
     
+    was_active = appt.status != 'Cancelled'
+    record_appointment_change(appt.date, appt.status, 'Cancelled')
     appt.status = 'Cancelled'
     db.session.commit()
+    tiered_cache.bump_version(*appointment_namespaces(appt.doctor_id, appt.patient_id))
+    if was_active:
+        slot_holds.slot_freed(appt.doctor_id, appt.date, appt.time_slot)
     return jsonify({'message': 'Appointment cancelled'}), 200
\ No newline at end of file
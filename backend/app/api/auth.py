@@ -1,7 +1,12 @@
-from flask import Blueprint, request, jsonify, session
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, request, jsonify, session, current_app
 from datetime import datetime
 from ..models import db, User, Patient
+from ..passwords import PasswordVerifierBusy, hash_password, needs_rehash
+from .. import password_verifier, tiered_cache
+from ..bundle import parse_bundle, run_bundle
+from ..search import index_entities
+from ..stats import adjust_counters
+from .decorators import login_required
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -18,14 +23,30 @@ def login():
         return jsonify({'message': 'Email and password are required'}), 400
 
     user = User.query.filter_by(email=email).first()
+    if not user:
+        return jsonify({'message': 'Invalid credentials'}), 401
 
-    if not user or not check_password_hash(user.password, password):
+    # Hash verification runs on the bounded verifier pool; shed load when it is saturated
+    try:
+        valid = password_verifier.verify(user.password, password)
+    except PasswordVerifierBusy:
+        return jsonify({'message': 'Too many login attempts, please retry shortly'}), 503, {'Retry-After': '1'}
+    if not valid:
         return jsonify({'message': 'Invalid credentials'}), 401
 
     if not user.is_active:
         return jsonify({'message': 'Account is inactive'}), 403
 
+    # Transparently upgrade hashes made with older parameters
+    if needs_rehash(user.password):
+        try:
+            user.password = password_verifier.hash(password)
+            db.session.commit()
+        except PasswordVerifierBusy:
+            pass  # Upgrade on a later login
+
     # Set Session
+    session.pop('profile_id', None)
     session['user_id'] = user.id
     session['role'] = user.role
     session['email'] = user.email
@@ -42,6 +63,10 @@ def login():
     elif user.role == 'patient' and user.patient_profile:
         response_data['profile_id'] = user.patient_profile.id
 
+    # Role decorators resolve the profile from this instead of a user_id lookup
+    if 'profile_id' in response_data:
+        session['profile_id'] = response_data['profile_id']
+
     return jsonify(response_data), 200
 
 @auth_bp.route('/register', methods=['POST'])
@@ -69,7 +94,7 @@ def register():
 
     try:
         # 1. Create User
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         new_user = User(
             email=email,
             password=hashed_password,
@@ -96,8 +121,12 @@ def register():
             is_blocked=False
         )
         db.session.add(new_patient)
+        db.session.flush()
+        index_entities('patient', [new_patient.id])
+        adjust_counters({'patients': 1})
         
         db.session.commit()
+        tiered_cache.bump_version('patients')
         return jsonify({'message': 'Patient registered successfully'}), 201
 
     except Exception as e:
@@ -125,4 +154,17 @@ def current_user():
         'user_id': session['user_id'],
         'role': session['role'],
         'email': session['email']
-    }), 200
\ No newline at end of file
+    }), 200
+
+@auth_bp.route('/bundle', methods=['POST'])
+@login_required
+def bundle():
+    """
+    Answers several GET endpoints in one round trip (see app/bundle.py).
+    Body: {"requests": ["/auth/me", "/patient/dashboard", {"path": ..., "etag": ...}]}
+    """
+    try:
+        entries = parse_bundle(request.get_json(silent=True), current_app.config['BUNDLE_MAX_REQUESTS'])
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return run_bundle(entries)
@@ -1,5 +1,67 @@
+from collections import namedtuple
 from functools import wraps
-from flask import session, jsonify
+from flask import session, jsonify, current_app, g
+from .. import tiered_cache
+from ..caching import LRUCache
+from ..database import primary_reads
+from ..models import db, User, Doctor, Patient
+from ..utils import QueryCounter
+
+# Lightweight, cacheable view of the logged-in user's profile row
+Profile = namedtuple('Profile', ['id', 'user_id', 'name'])
+
+# Per-process cache of resolved profiles: (role, profile id) -> (namespace version, Profile)
+_profile_cache = LRUCache(max_entries=10000)
+
+def _profile_namespace(role, profile_id):
+    # 'patient:<id>' is the same namespace patient_namespaces() bumps on profile edits
+    return f'{role}:{profile_id}'
+
+def load_profile(model, role):
+    """
+    Resolves the Doctor/Patient profile of the session user once per request.
+    Uses the profile_id stored at login (falling back to a user_id lookup for older
+    sessions) and a short-TTL cache (PROFILE_CACHE_TTL seconds, 0 disables) whose entries
+    are tied to the profile's shared cache version, so invalidate_profile() reaches every
+    process within CACHE_VERSION_TTL. Always read from the primary database.
+    Returns None if the profile does not exist or its account is deactivated (e.g. a
+    deleted doctor), which also ends sessions issued before the deactivation.
+    """
+    user_id = session['user_id']
+    profile_id = session.get('profile_id')
+    ttl = current_app.config.get('PROFILE_CACHE_TTL', 0)
+
+    version = None
+    if profile_id is not None and ttl:
+        version = tiered_cache.get_version(_profile_namespace(role, profile_id))
+        cached = _profile_cache.get((role, profile_id))
+        if cached is not None and cached[0] == version and cached[1].user_id == user_id:
+            return cached[1]
+
+    query = db.session.query(model.id, model.user_id, model.name) \
+        .join(User, model.user_id == User.id).filter(User.is_active == True)
+    if profile_id is not None:
+        query = query.filter(model.id == profile_id, model.user_id == user_id)
+    else:
+        query = query.filter(model.user_id == user_id)
+    # A replica may not have the profile yet (e.g. right after registration)
+    with primary_reads():
+        row = query.first()
+    if not row:
+        return None
+
+    profile = Profile(*row)
+    session['profile_id'] = profile.id
+    if ttl:
+        if version is None:
+            version = tiered_cache.get_version(_profile_namespace(role, profile.id))
+        _profile_cache.set((role, profile.id), (version, profile), timeout=ttl, size=0)
+    return profile
+
+def invalidate_profile(role, profile_id):
+    """Drops a cached profile in every process after its row changes (name edits, deactivation)."""
+    _profile_cache.delete((role, profile_id))
+    tiered_cache.bump_version(_profile_namespace(role, profile_id))
 
 def login_required(f):
     """
@@ -30,6 +92,7 @@ def admin_required(f):
 def doctor_required(f):
     """
     Decorator to ensure the logged-in user is a Doctor.
+    Exposes the resolved profile as g.doctor (reused if already resolved, e.g. by a bundle).
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -38,6 +101,10 @@ def doctor_required(f):
             
         if session.get('role') != 'doctor':
             return jsonify({'message': 'Doctor access required'}), 403
+
+        g.doctor = g.get('doctor') or load_profile(Doctor, 'doctor')
+        if g.doctor is None:
+            return jsonify({'message': 'Doctor profile not found'}), 404
             
         return f(*args, **kwargs)
     return decorated_function
@@ -45,6 +112,7 @@ def doctor_required(f):
 def patient_required(f):
     """
     Decorator to ensure the logged-in user is a Patient.
+    Exposes the resolved profile as g.patient (reused if already resolved, e.g. by a bundle).
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -53,6 +121,37 @@ def patient_required(f):
             
         if session.get('role') != 'patient':
             return jsonify({'message': 'Patient access required'}), 403
+
+        g.patient = g.get('patient') or load_profile(Patient, 'patient')
+        if g.patient is None:
+            return jsonify({'message': 'Patient profile not found'}), 404
             
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when an endpoint issues more SQL statements than its declared budget."""
+
+def query_budget(max_queries):
+    """
+    Decorator declaring the maximum number of SQL statements an endpoint may issue.
+    Only enforced when QUERY_BUDGET_ENFORCED is set (defaults to TESTING), so an
+    N+1 regression fails the test run instead of silently reaching production.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.config.get('QUERY_BUDGET_ENFORCED', current_app.config.get('TESTING')):
+                return f(*args, **kwargs)
+
+            with QueryCounter() as counter:
+                response = f(*args, **kwargs)
+            if counter.count > max_queries:
+                raise QueryBudgetExceeded(
+                    f"{f.__name__} issued {counter.count} queries (budget {max_queries}):\n"
+                    + "\n".join(counter.statements)
+                )
+            return response
+        decorated_function.query_budget = max_queries
+        return decorated_function
+    return decorator
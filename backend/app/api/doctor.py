@@ -1,42 +1,56 @@
-import json
-from flask import Blueprint, request, jsonify, session
-from ..models import db, Doctor, Appointment, Treatment, Patient
-from .decorators import doctor_required
+from flask import Blueprint, request, jsonify, g
+from sqlalchemy import func
+from ..models import db, User, Doctor, Appointment, Treatment, Patient
+from ..queries import completed_history_query
+from ..search import index_treatments, search_treatments
+from ..slots import replace_schedule
+from ..stats import record_appointment_change
+from .. import tiered_cache
+from ..caching import appointment_namespaces
+from ..serialization import json_response, records
+from ..utils import parse_limit, encode_cursor, decode_cursor
+from .decorators import doctor_required, query_budget
 
 doctor_bp = Blueprint('doctor', __name__)
 
 @doctor_bp.route('/dashboard', methods=['GET'])
 @doctor_required
+@tiered_cache.conditional('appointments:doctor:{g.doctor.id}', 'doctors', 'patients')
+@query_budget(2)
 def dashboard():
-    user_id = session.get('user_id')
-    doctor = Doctor.query.filter_by(user_id=user_id).first()
+    doctor = g.doctor
     
     # 1. Upcoming Appointments (Status = 'Booked')
-    upcoming_objs = Appointment.query.filter_by(doctor_id=doctor.id, status='Booked').all()
+    upcoming_rows = db.session.query(
+        Appointment.id, Appointment.date, Appointment.time_slot, Appointment.status,
+        Patient.name.label('patient_name')
+    ).join(Patient, Appointment.patient_id == Patient.id) \
+     .filter(Appointment.doctor_id == doctor.id, Appointment.status == 'Booked').all()
     upcoming_data = [{
         'id': a.id, 
-        'patient_name': a.patient.name, 
+        'patient_name': a.patient_name, 
         'date': a.date.isoformat(),
         'time_slot': a.time_slot, 
         'status': a.status
-    } for a in upcoming_objs]
+    } for a in upcoming_rows]
 
     # 2. Assigned Patients (Unique patients who have COMPLETED appointments with this doctor)
-    completed_apts = Appointment.query.filter_by(doctor_id=doctor.id, status='Completed').all()
-    
-    # Use a dictionary to filter unique patients
-    patients_map = {}
-    for apt in completed_apts:
-        if apt.patient_id not in patients_map:
-            patients_map[apt.patient_id] = {
-                'patient_id': apt.patient.id,
-                'patient_name': apt.patient.name,
-                'email': apt.patient.user.email,
-                'contact': apt.patient.contact_info,
-                'last_visit': apt.date.isoformat()
-            }
-    
-    assigned_patients_data = list(patients_map.values())
+    # Grouped in SQL so each patient appears once with their most recent visit
+    assigned_rows = db.session.query(
+        Patient.id, Patient.name, Patient.contact_info, User.email,
+        func.max(Appointment.date).label('last_visit')
+    ).join(Appointment, Appointment.patient_id == Patient.id) \
+     .join(User, Patient.user_id == User.id) \
+     .filter(Appointment.doctor_id == doctor.id, Appointment.status == 'Completed') \
+     .group_by(Patient.id, Patient.name, Patient.contact_info, User.email).all()
+
+    assigned_patients_data = [{
+        'patient_id': p.id,
+        'patient_name': p.name,
+        'email': p.email,
+        'contact': p.contact_info,
+        'last_visit': p.last_visit.isoformat()
+    } for p in assigned_rows]
 
     return jsonify({
         'doctor_name': doctor.name, 
@@ -46,41 +60,74 @@ def dashboard():
 
 @doctor_bp.route('/patient/<int:patient_id>/history', methods=['GET'])
 @doctor_required
+@query_budget(2)
 def get_patient_history(patient_id):
     """View past treatments of a specific patient"""
-    patient = Patient.query.get(patient_id)
-    if not patient:
+    patient_name = db.session.query(Patient.name).filter_by(id=patient_id).scalar()
+    if patient_name is None:
         return jsonify({'message': 'Patient not found'}), 404
 
-    history = Appointment.query.filter_by(patient_id=patient_id, status='Completed').all()
-    
-    output = []
-    for apt in history:
-        if apt.treatment:
-            output.append({
-                'date': apt.date.isoformat(),
-                'doctor_name': apt.doctor.name,
-                'diagnosis': apt.treatment.diagnosis,
-                'prescription': apt.treatment.prescription,
-                'notes': apt.treatment.notes
-            })
-            
-    return jsonify({'patient_name': patient.name, 'history': output}), 200
+    rows = completed_history_query(patient_id).with_entities(
+        Appointment.date, Doctor.name, Treatment.diagnosis, Treatment.prescription, Treatment.notes).all()
+    fields = ('date', 'doctor_name', 'diagnosis', 'prescription', 'notes')
+    return json_response({'patient_name': patient_name, 'history': records(rows, fields)})
+
+@doctor_bp.route('/treatments/search', methods=['GET'])
+@doctor_required
+@query_budget(1)
+def search_treatments_view():
+    """
+    Full-text search over the calling doctor's treatment records (diagnosis, prescription,
+    notes). Newest first; pages with limit (max 100) and cursor from the previous page.
+    """
+    args = request.args
+    query = args.get('q', '').strip()
+    if not query:
+        return jsonify({'message': 'Query parameter q is required'}), 400
+    try:
+        limit = parse_limit(args.get('limit'), default=20, maximum=100)
+        before_id = int(decode_cursor(args['cursor'])[0]) if args.get('cursor') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid pagination parameters'}), 400
+
+    # One extra row tells us whether another page exists
+    rows = search_treatments(g.doctor.id, query, limit + 1, before_id)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    output = [{
+        'id': r['id'],
+        'appointment_id': r['appointment_id'],
+        'date': r['date'].isoformat(),
+        'patient_id': r['patient_id'],
+        'patient_name': r['patient_name'],
+        'diagnosis': r['diagnosis'],
+        'prescription': r['prescription'],
+        'notes': r['notes'],
+        'matched_field': r['matched_field'],
+        'snippet': r['snippet']
+    } for r in rows]
+    next_cursor = encode_cursor(rows[-1]['id']) if has_more else None
+    return jsonify({'results': output, 'next_cursor': next_cursor}), 200
 
 @doctor_bp.route('/availability', methods=['PUT'])
 @doctor_required
 def update_availability():
-    user_id = session.get('user_id')
-    doctor = Doctor.query.filter_by(user_id=user_id).first()
-    doctor.availability_schedule = json.dumps(request.json.get('schedule'))
+    doctor = g.doctor
+
+    schedule = request.json.get('schedule')
+    if not isinstance(schedule, dict):
+        return jsonify({'message': 'Schedule must map weekday names to lists of time slots'}), 400
+
+    replace_schedule(doctor.id, schedule)
     db.session.commit()
+    tiered_cache.bump_version('doctors')
     return jsonify({'message': 'Availability updated'}), 200
 
 @doctor_bp.route('/appointment/<int:id>/complete', methods=['POST'])
 @doctor_required
 def complete(id):
-    user_id = session.get('user_id')
-    doctor = Doctor.query.filter_by(user_id=user_id).first()
+    doctor = g.doctor
     appt = Appointment.query.filter_by(id=id, doctor_id=doctor.id).first()
     
     if not appt: return jsonify({'message': 'Not found'}), 404
@@ -89,6 +136,10 @@ def complete(id):
     treatment = Treatment(appointment_id=appt.id, diagnosis=data['diagnosis'], 
                           prescription=data['prescription'], notes=data.get('notes'))
     db.session.add(treatment)
+    record_appointment_change(appt.date, appt.status, 'Completed')
     appt.status = 'Completed'
+    db.session.flush()
+    index_treatments([treatment.id])
     db.session.commit()
+    tiered_cache.bump_version(*appointment_namespaces(doctor.id, appt.patient_id))
     return jsonify({'message': 'Completed'}), 200
\ No newline at end of file
@@ -1,13 +1,24 @@
-import json
-from flask import Blueprint, request, jsonify, session
-from datetime import datetime, date
-from ..models import db, Patient, Doctor, Appointment, Department
-from .decorators import patient_required
-from ..tasks import export_patient_history
-from .. import cache
+import os
+from flask import Blueprint, request, jsonify, session, current_app, send_file, url_for, g
+from datetime import datetime, date, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from ..models import db, Patient, Doctor, Appointment, Department, Treatment
+from ..queries import completed_history_query
+from ..search import search_ids, search_page_args, in_rank_order, index_entities
+from ..stats import record_appointment_change
+from ..slots import WEEKDAYS, free_slots, load_templates, template_to_schedule, available_doctor_ids
+from ..serialization import json_response, records
+from ..utils import parse_date, parse_time
+from .decorators import patient_required, query_budget, invalidate_profile
+from ..tasks import export_patient_history, export_fingerprint, export_filename, export_heartbeat, export_is_alive
+from .. import cache, slot_holds, tiered_cache
+from ..caching import appointment_namespaces, patient_namespaces
 
 patient_bp = Blueprint('patient', __name__)
 
+MAX_SLOT_RANGE_DAYS = 31
+
 @patient_bp.route('/departments', methods=['GET'])
 @patient_required
 def get_departments():
@@ -17,35 +28,116 @@ def get_departments():
 
 @patient_bp.route('/doctors', methods=['GET'])
 @patient_required
-@cache.cached(timeout=60, query_string=True)
+@tiered_cache.conditional('doctors')
+@tiered_cache.cached('doctors')
+@query_budget(2)
 def get_doctors():
+    """
+    Approved doctors with their weekly availability.
+    Optional filters: specialization_id, day (weekday name or 0-6, Monday = 0) and
+    time_from/time_to (HH:MM) to find doctors with a slot starting in that window.
+    """
     spec_id = request.args.get('specialization_id')
-    query = Doctor.query.filter_by(is_approved=True)
+    query = db.session.query(Doctor.id, Doctor.name, func.coalesce(Department.name, 'General')) \
+        .outerjoin(Department, Doctor.specialization_id == Department.id) \
+        .filter(Doctor.is_approved == True)
     if spec_id:
-        query = query.filter_by(specialization_id=spec_id)
+        query = query.filter(Doctor.specialization_id == spec_id)
+
+    day = request.args.get('day')
+    if day:
+        try:
+            weekday = WEEKDAYS.index(day.capitalize()) if not day.isdigit() else int(day)
+            if not 0 <= weekday < len(WEEKDAYS):
+                raise ValueError('Invalid weekday')
+            time_from = parse_time(request.args['time_from']) if request.args.get('time_from') else None
+            time_to = parse_time(request.args['time_to']) if request.args.get('time_to') else None
+        except ValueError:
+            return jsonify({'message': 'Invalid day or time window'}), 400
+        query = query.filter(Doctor.id.in_(available_doctor_ids(weekday, time_from, time_to)))
     
-    doctors = query.all()
-    doctor_list = []
-    for doc in doctors:
-        availability = []
-        if doc.availability_schedule:
-            try:
-                availability = json.loads(doc.availability_schedule)
-            except:
-                availability = []
-        doctor_list.append({
-            'id': doc.id,
-            'name': doc.name,
-            'specialization': doc.department.name if doc.department else 'General',
-            'availability': availability
-        })
-    return jsonify(doctor_list), 200
+    rows = query.all()
+    templates = load_templates([doctor_id for doctor_id, _, _ in rows])
+    output = [{
+        'id': doctor_id,
+        'name': name,
+        'specialization': specialization,
+        'availability': template_to_schedule(templates[doctor_id])
+    } for doctor_id, name, specialization in rows]
+    return json_response(output)
+
+def _slot_range():
+    """Reads date_from/date_to query args (default: the next 7 days, at most 31 days, never in the past)."""
+    today = date.today()
+    start = parse_date(request.args['date_from']) if request.args.get('date_from') else today
+    end = parse_date(request.args['date_to']) if request.args.get('date_to') else start + timedelta(days=6)
+    start = max(start, today)
+    if end < start or (end - start).days > MAX_SLOT_RANGE_DAYS:
+        raise ValueError('Invalid date range')
+    return start, end
+
+@patient_bp.route('/doctors/search', methods=['GET'])
+@patient_required
+@query_budget(3)
+def search_doctors():
+    """Ranked, typo-tolerant doctor search by name or department (approved doctors only)."""
+    try:
+        q, limit, offset, mode = search_page_args(request.args)
+    except ValueError:
+        return jsonify({'message': 'Invalid pagination parameters'}), 400
+
+    ids, mode = search_ids('doctor', q, limit, offset, mode, approved_only=True)
+    rows = db.session.query(Doctor.id, Doctor.name, Department.name.label('department_name')) \
+        .outerjoin(Department, Doctor.specialization_id == Department.id) \
+        .filter(Doctor.id.in_(ids), Doctor.is_approved == True).all() if ids else []
+
+    output = [{
+        'id': doc.id,
+        'name': doc.name,
+        'specialization': doc.department_name or 'General'
+    } for doc in in_rank_order(rows, ids)]
+    next_offset = offset + limit if len(ids) == limit else None
+    return jsonify({'results': output, 'mode': mode, 'next_offset': next_offset}), 200
+
+@patient_bp.route('/doctors/<int:doctor_id>/slots', methods=['GET'])
+@patient_required
+@query_budget(3)
+def get_doctor_slots(doctor_id):
+    """Open slots for one doctor over a date range, keyed by date."""
+    doctor = Doctor.query.filter_by(id=doctor_id, is_approved=True).first()
+    if not doctor:
+        return jsonify({'message': 'Doctor not found'}), 404
+
+    try:
+        start, end = _slot_range()
+    except ValueError:
+        return jsonify({'message': 'Invalid date range'}), 400
+
+    slots = free_slots([doctor.id], start, end, g.patient.id)
+    return jsonify({'doctor_id': doctor.id, 'date_from': start.isoformat(),
+                    'date_to': end.isoformat(), 'slots': slots[doctor.id]}), 200
+
+@patient_bp.route('/departments/<int:dept_id>/slots', methods=['GET'])
+@patient_required
+@query_budget(3)
+def get_department_slots(dept_id):
+    """Open slots for every approved doctor of a department, computed in one pass."""
+    try:
+        start, end = _slot_range()
+    except ValueError:
+        return jsonify({'message': 'Invalid date range'}), 400
+
+    doctors = db.session.query(Doctor.id, Doctor.name) \
+        .filter(Doctor.specialization_id == dept_id, Doctor.is_approved == True).all()
+    slots = free_slots([d.id for d in doctors], start, end, g.patient.id)
+    output = [{'doctor_id': d.id, 'name': d.name, 'slots': slots[d.id]} for d in doctors]
+    return jsonify({'date_from': start.isoformat(), 'date_to': end.isoformat(), 'doctors': output}), 200
 
 @patient_bp.route('/book', methods=['POST'])
 @patient_required
+@query_budget(6)
 def book_appointment():
-    user_id = session.get('user_id')
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = g.patient
     
     data = request.get_json()
     doctor_id, date_str, time_slot = data.get('doctor_id'), data.get('date'), data.get('time_slot')
@@ -55,30 +147,45 @@ def book_appointment():
 
     try:
         appt_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        doctor_id = int(doctor_id)
     except ValueError:
-        return jsonify({'message': 'Invalid date format'}), 400
+        return jsonify({'message': 'Invalid date format or doctor_id'}), 400
 
-    existing_appt = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.date == appt_date,
-        Appointment.time_slot == time_slot,
-        Appointment.status != 'Cancelled'
-    ).first()
+    # Competing requests for the same slot are turned away by the hold, before any SQL
+    if not slot_holds.hold(doctor_id, appt_date, time_slot, patient.id):
+        return jsonify({'message': 'Slot is being booked by another patient'}), 409
 
-    if existing_appt:
-        return jsonify({'message': 'Slot already booked'}), 409
+    # Unapproved covers soft-deleted doctors whose purge is still running
+    if not db.session.query(Doctor.id).filter_by(id=doctor_id, is_approved=True).scalar():
+        slot_holds.release(doctor_id, appt_date, time_slot, patient.id)
+        return jsonify({'message': 'Doctor not found'}), 404
 
+    # The partial unique index on active slots rejects double bookings atomically,
+    # so the insert itself is the availability check
     new_appt = Appointment(patient_id=patient.id, doctor_id=doctor_id, date=appt_date, time_slot=time_slot)
     db.session.add(new_appt)
-    db.session.commit()
+    try:
+        # Counter updates flush the insert, so they sit inside the conflict handling too
+        record_appointment_change(appt_date, None, 'Booked')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        slot_holds.release(doctor_id, appt_date, time_slot, patient.id)
+        return jsonify({'message': 'Slot already booked'}), 409
+    except Exception:
+        # e.g. "database is locked": free the slot for others instead of holding it for the TTL
+        db.session.rollback()
+        slot_holds.release(doctor_id, appt_date, time_slot, patient.id)
+        raise
+    tiered_cache.bump_version(*appointment_namespaces(doctor_id, patient.id))
+    slot_holds.booked(doctor_id, appt_date, time_slot)
     return jsonify({'message': 'Booked successfully'}), 201
 
 # --- NEW FEATURE: Cancel Appointment ---
 @patient_bp.route('/appointments/<int:id>/cancel', methods=['PUT'])
 @patient_required
 def cancel_appointment(id):
-    user_id = session.get('user_id')
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = g.patient
     
     appt = Appointment.query.filter_by(id=id, patient_id=patient.id).first()
     
@@ -88,20 +195,81 @@ def cancel_appointment(id):
     if appt.status == 'Completed':
         return jsonify({'message': 'Cannot cancel completed appointments'}), 400
         
+    was_active = appt.status != 'Cancelled'
+    record_appointment_change(appt.date, appt.status, 'Cancelled')
     appt.status = 'Cancelled'
     db.session.commit()
+    tiered_cache.bump_version(*appointment_namespaces(appt.doctor_id, patient.id))
+    if was_active:
+        slot_holds.slot_freed(appt.doctor_id, appt.date, appt.time_slot)
     return jsonify({'message': 'Appointment cancelled'}), 200
 # ---------------------------------------
 
+def _waitlist_slot(data):
+    """(doctor_id, date, time_slot) from a waitlist request; raises ValueError."""
+    if not all(data.get(field) for field in ('doctor_id', 'date', 'time_slot')):
+        raise ValueError('Missing fields')
+    return int(data['doctor_id']), parse_date(data['date']), data['time_slot']
+
+@patient_bp.route('/waitlist', methods=['POST'])
+@patient_required
+@query_budget(1)
+def join_waitlist():
+    """
+    Queues for a booked slot, or one currently held for someone else (an open offer).
+    If it is cancelled, the first patient in line gets it reserved for SLOT_OFFER_TTL
+    seconds and is notified; an offer that lapses passes to the next in line.
+    """
+    try:
+        doctor_id, appt_date, time_slot = _waitlist_slot(request.get_json() or {})
+    except ValueError:
+        return jsonify({'message': 'Missing or invalid doctor_id, date or time_slot'}), 400
+    if appt_date < date.today():
+        return jsonify({'message': 'Cannot wait for a past slot'}), 400
+
+    holder = db.session.query(Appointment.patient_id).filter(
+        Appointment.doctor_id == doctor_id, Appointment.date == appt_date,
+        Appointment.time_slot == time_slot, Appointment.status != 'Cancelled'
+    ).scalar()
+    if holder == g.patient.id:
+        return jsonify({'message': 'You already have this slot'}), 400
+    if holder is None:
+        held_by = slot_holds.holder(doctor_id, appt_date, time_slot)
+        if held_by is None:
+            return jsonify({'message': 'Slot is free, book it instead'}), 409
+        if held_by == g.patient.id:
+            return jsonify({'message': 'Slot is reserved for you, book it now'}), 409
+
+    position = slot_holds.join_waitlist(doctor_id, appt_date, time_slot, g.patient.id)
+    if position is None:
+        return jsonify({'message': 'Waitlist is temporarily unavailable'}), 503
+    return jsonify({'message': 'Added to waitlist', 'position': position}), 201
+
+@patient_bp.route('/waitlist', methods=['DELETE'])
+@patient_required
+def leave_waitlist():
+    """Leaves a slot's waitlist (same fields as joining, as JSON or query args)."""
+    try:
+        doctor_id, appt_date, time_slot = _waitlist_slot(request.get_json(silent=True) or request.args)
+    except ValueError:
+        return jsonify({'message': 'Missing or invalid doctor_id, date or time_slot'}), 400
+    slot_holds.leave_waitlist(doctor_id, appt_date, time_slot, g.patient.id)
+    return jsonify({'message': 'Removed from waitlist'}), 200
+
 @patient_bp.route('/dashboard', methods=['GET'])
 @patient_required
+@tiered_cache.conditional('appointments:patient:{g.patient.id}', 'patient:{g.patient.id}', 'doctors')
+@query_budget(1)
 def dashboard():
-    user_id = session.get('user_id')
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = g.patient
     
-    upcoming = Appointment.query.filter_by(patient_id=patient.id).filter(Appointment.status != 'Cancelled').all()
+    upcoming = db.session.query(
+        Appointment.id, Appointment.date, Appointment.time_slot, Appointment.status,
+        Doctor.name.label('doctor_name')
+    ).join(Doctor, Appointment.doctor_id == Doctor.id) \
+     .filter(Appointment.patient_id == patient.id, Appointment.status != 'Cancelled').all()
     output = [{
-        'id': a.id, 'doctor_name': a.doctor.name, 'date': a.date.isoformat(), 
+        'id': a.id, 'doctor_name': a.doctor_name, 'date': a.date.isoformat(), 
         'time_slot': a.time_slot, 'status': a.status
     } for a in upcoming]
     
@@ -109,41 +277,95 @@ def dashboard():
 
 @patient_bp.route('/history', methods=['GET'])
 @patient_required
+@tiered_cache.conditional('appointments:patient:{g.patient.id}', 'doctors')
+@query_budget(1)
 def history():
-    user_id = session.get('user_id')
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = g.patient
     
-    history = Appointment.query.filter_by(patient_id=patient.id, status='Completed').all()
-    output = []
-    for apt in history:
-        if apt.treatment:
-            output.append({
-                'id': apt.id,
-                'date': apt.date.isoformat(),
-                'doctor_name': apt.doctor.name,
-                'diagnosis': apt.treatment.diagnosis,
-                'prescription': apt.treatment.prescription,
-                'notes': apt.treatment.notes
-            })
-    return jsonify(output), 200
+    rows = completed_history_query(patient.id).with_entities(
+        Appointment.id, Appointment.date, Doctor.name, Treatment.diagnosis, Treatment.prescription, Treatment.notes).all()
+    return json_response(records(rows, ('id', 'date', 'doctor_name', 'diagnosis', 'prescription', 'notes')))
 
 @patient_bp.route('/export', methods=['POST'])
 @patient_required
 def export_data():
-    user_id = session.get('user_id')
-    export_patient_history.delay(user_id)
-    return jsonify({'message': 'Export started'}), 202
+    patient = g.patient
+
+    # Identical requests share one artifact until a new treatment is recorded
+    filename = export_filename(patient.id, export_fingerprint(patient.id))
+    latest = cache.get(f'export:latest:{patient.id}')
+    if latest and latest['filename'] == filename:
+        ready = os.path.exists(os.path.join(current_app.config['EXPORT_DIR'], filename))
+        # A failed export, or one whose worker or message was lost, is started again
+        lost = not ready and (export_patient_history.AsyncResult(latest['task_id']).state == 'FAILURE'
+                              or not export_is_alive(latest['task_id']))
+        if not lost:
+            return jsonify({'message': 'Export ready' if ready else 'Export already in progress',
+                            'task_id': latest['task_id']}), 200 if ready else 202
+
+    task = export_patient_history.delay(session['user_id'], filename)
+    export_heartbeat(task.id)
+    ttl = current_app.config['EXPORT_TTL']
+    cache.set(f'export:task:{task.id}', {'patient_id': patient.id, 'filename': filename}, timeout=ttl)
+    cache.set(f'export:latest:{patient.id}', {'task_id': task.id, 'filename': filename}, timeout=ttl)
+    return jsonify({'message': 'Export started', 'task_id': task.id}), 202
+
+def _export_record(task_id):
+    """The export record of task_id if it belongs to the logged-in patient, else None."""
+    patient = g.patient
+    record = cache.get(f'export:task:{task_id}')
+    if not record or record['patient_id'] != patient.id:
+        return None
+    return record
+
+@patient_bp.route('/export/<task_id>', methods=['GET'])
+@patient_required
+def export_status(task_id):
+    record = _export_record(task_id)
+    if not record:
+        return jsonify({'message': 'Export not found'}), 404
+
+    path = os.path.join(current_app.config['EXPORT_DIR'], record['filename'])
+    if os.path.exists(path):
+        return jsonify({'status': 'ready', 'size': os.path.getsize(path),
+                        'download_url': url_for('patient.export_download', task_id=task_id)}), 200
+
+    result = export_patient_history.AsyncResult(task_id)
+    if result.state == 'PROGRESS':
+        return jsonify({'status': 'in_progress', 'progress': result.info}), 200
+    if result.state == 'FAILURE':
+        return jsonify({'status': 'failed'}), 200
+    if result.state == 'SUCCESS':
+        # Finished but the file is gone (superseded by a newer export)
+        return jsonify({'status': 'expired'}), 410
+    return jsonify({'status': 'pending'}), 200
+
+@patient_bp.route('/export/<task_id>/download', methods=['GET'])
+@patient_required
+def export_download(task_id):
+    """Streams the gzipped CSV; send_file handles Range and conditional requests."""
+    record = _export_record(task_id)
+    if not record:
+        return jsonify({'message': 'Export not found'}), 404
+
+    path = os.path.join(current_app.config['EXPORT_DIR'], record['filename'])
+    if not os.path.exists(path):
+        return jsonify({'message': 'Export not ready'}), 404
+    return send_file(path, mimetype='application/gzip', as_attachment=True,
+                     download_name='history.csv.gz', conditional=True)
 
 @patient_bp.route('/profile', methods=['PUT'])
 @patient_required
 def update_profile():
-    user_id = session.get('user_id')
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = db.session.get(Patient, g.patient.id)
     
     data = request.get_json()
     if 'name' in data: patient.name = data['name']
     if 'contact_info' in data: patient.contact_info = data['contact_info']
     if 'address' in data: patient.address = data['address']
+    index_entities('patient', [patient.id])
     
     db.session.commit()
+    invalidate_profile('patient', patient.id)
+    tiered_cache.bump_version(*patient_namespaces(patient.id))
     return jsonify({'message': 'Profile updated'}), 200
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Bulk import of doctors and patients from CSV or NDJSON.
+
+Rows are read and validated as a stream, passwords of each batch are hashed across a
+process pool, and User + profile rows are written with batched Core inserts (one
+transaction per batch). Invalid rows are collected into a per-row error report instead
+of aborting the import; if a batch insert fails, its rows are retried one at a time so
+only the offending ones are reported. Emails are compared case-insensitively, both
+within the import and against existing accounts.
+
+The pool uses the 'spawn' start method: imports run inside a multithreaded server, and
+forking a process with other threads running can deadlock the child.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import func
+from .models import db, User, Doctor, Patient, Department
+from .passwords import hasher_for_app
+from .search import index_entities
+from .stats import adjust_counters
+
+IMPORT_KINDS = ('doctors', 'patients')
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+def iter_records(text_stream, fmt):
+    """Yields (line number, dict) from a CSV (with header) or NDJSON text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            yield line_no, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+def validate_record(kind, record, department_ids):
+    """Returns (clean row, None) or (None, error message)."""
+    if record is None:
+        return None, 'Malformed record'
+
+    def field(name):
+        value = record.get(name)
+        return str(value).strip() if value not in (None, '') else None
+
+    row = {'email': field('email'), 'password': field('password'), 'name': field('name')}
+    if not all(row.values()):
+        return None, 'Email, password, and name are required'
+    if '@' not in row['email']:
+        return None, 'Invalid email'
+
+    if kind == 'doctors':
+        try:
+            row['specialization_id'] = int(field('specialization_id'))
+        except (TypeError, ValueError):
+            return None, 'specialization_id must be an integer'
+        if row['specialization_id'] not in department_ids:
+            return None, 'Unknown specialization_id'
+    else:
+        row['dob'] = None
+        if field('dob'):
+            try:
+                row['dob'] = datetime.strptime(field('dob'), '%Y-%m-%d').date()
+            except ValueError:
+                return None, 'Invalid date format for dob. Use YYYY-MM-DD.'
+        row['contact_info'] = field('contact_info')
+        row['address'] = field('address')
+    return row, None
+
+class BulkImporter:
+    """Runs one import. Use as a context manager so the hashing pool is shut down."""
+
+    def __init__(self, kind, hash_workers=None, batch_size=IMPORT_BATCH_SIZE):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f'Unknown import kind: {kind}')
+        self.kind = kind
+        self.batch_size = batch_size
+        self.hash_workers = hash_workers if hash_workers is not None else (os.cpu_count() or 1)
+        self.pool = None
+        self.hasher = hasher_for_app()
+        self.report = {'created': 0, 'failed': 0, 'errors': []}
+        self._seen_emails = set()
+
+    def __enter__(self):
+        if self.hash_workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.hash_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.pool:
+            self.pool.shutdown()
+        return False
+
+    def _error(self, line_no, email, message):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line_no, 'email': email, 'error': message})
+
+    def run(self, text_stream, fmt):
+        department_ids = {d for (d,) in db.session.query(Department.id)}
+        batch = []
+        for line_no, record in iter_records(text_stream, fmt):
+            row, error = validate_record(self.kind, record, department_ids)
+            if error:
+                self._error(line_no, (record or {}).get('email'), error)
+                continue
+            email_key = row['email'].lower()
+            if email_key in self._seen_emails:
+                self._error(line_no, row['email'], 'Duplicate email in import')
+                continue
+            self._seen_emails.add(email_key)
+            batch.append((line_no, row))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        self.report['errors'].sort(key=lambda e: e['line'])
+        self.report['errors_truncated'] = self.report['failed'] > len(self.report['errors'])
+        return self.report
+
+    def _flush(self, batch):
+        # Existing accounts are checked once per batch (served by ix_user_email_lower)
+        emails = [row['email'].lower() for _, row in batch]
+        existing = {e for (e,) in db.session.query(func.lower(User.email)).filter(func.lower(User.email).in_(emails))}
+        pending = []
+        for line_no, row in batch:
+            if row['email'].lower() in existing:
+                self._error(line_no, row['email'], 'Email already registered')
+            else:
+                pending.append((line_no, row))
+        if not pending:
+            return
+
+        passwords = [row['password'] for _, row in pending]
+        if self.pool:
+            chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+            hashes = list(self.pool.map(self.hasher, passwords, chunksize=chunksize))
+        else:
+            hashes = [self.hasher(p) for p in passwords]
+
+        try:
+            self._insert(pending, hashes)
+        except Exception:
+            db.session.rollback()
+            # Retry row by row so only the rows that cannot be inserted are reported
+            for (line_no, row), hashed in zip(pending, hashes):
+                try:
+                    self._insert([(line_no, row)], [hashed])
+                except Exception as e:
+                    db.session.rollback()
+                    # The driver's message only: the statement parameters include the password hash
+                    self._error(line_no, row['email'], f"Insert failed: {getattr(e, 'orig', e)}")
+
+    def _insert(self, rows, hashes):
+        """Inserts the users and profiles of rows in one transaction and commits."""
+        role = 'doctor' if self.kind == 'doctors' else 'patient'
+        user_ids = db.session.execute(
+            db.insert(User).returning(User.id, User.email, sort_by_parameter_order=True),
+            [{'email': row['email'], 'password': hashed, 'role': role, 'is_active': True}
+             for (_, row), hashed in zip(rows, hashes)]
+        ).all()
+        id_by_email = {email: user_id for user_id, email in user_ids}
+
+        if self.kind == 'doctors':
+            profile_ids = db.session.execute(db.insert(Doctor).returning(Doctor.id), [{
+                'user_id': id_by_email[row['email']], 'name': row['name'],
+                'specialization_id': row['specialization_id'], 'is_approved': True
+            } for _, row in rows]).scalars().all()
+        else:
+            profile_ids = db.session.execute(db.insert(Patient).returning(Patient.id), [{
+                'user_id': id_by_email[row['email']], 'name': row['name'], 'dob': row['dob'],
+                'contact_info': row['contact_info'], 'address': row['address'], 'is_blocked': False
+            } for _, row in rows]).scalars().all()
+        index_entities(self.kind[:-1], profile_ids)
+        adjust_counters({self.kind: len(rows)})
+        db.session.commit()
+        self.report['created'] += len(rows)
+
+def detect_format(filename=None, content_type=None, explicit=None):
+    """Picks 'csv' or 'ndjson' from an explicit value, file extension or content type."""
+    if explicit:
+        return explicit.lower()
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if content_type and 'ndjson' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+def import_users(kind, binary_stream, fmt, hash_workers=None):
+    """Imports from a binary stream (upload, request body or file). Returns the report."""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    with BulkImporter(kind, hash_workers=hash_workers) as importer:
+        return importer.run(text_stream, fmt)
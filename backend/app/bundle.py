@@ -0,0 +1,108 @@
+"""
+Request bundles: several read-only API calls answered in one round trip.
+
+    POST /auth/bundle
+    {"requests": ["/auth/me", "/patient/dashboard", {"path": "/patient/history", "etag": "\"...\""}]}
+
+returns {"responses": [{"path", "status", "etag", "body"}, ...]} in request order. Each
+sub-request is a GET (so bundles cannot nest) dispatched straight to its view (routing,
+role decorator, view; no before/after_request hooks) as the session user. The role
+profile is resolved once and shared through g, and the sub-responses' JSON bodies are
+spliced into the result without being decoded again. An "etag" is sent as
+If-None-Match, so unchanged parts come back as 304 with a null body. A sub-request
+that raises is logged and answered with a 500 of its own; the other parts are kept.
+
+With BUNDLE_WORKERS > 1 the sub-requests run concurrently on a thread pool; each worker
+gets its own app context and DB session (sessions are not thread-safe) seeded with the
+same identity. With 1 they run in order on the bundle request's own context and session.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g, request, session
+from werkzeug.exceptions import HTTPException
+from .api.decorators import load_profile
+from .database import replica_usable
+from .models import db, Doctor, Patient
+from .serialization import dumps
+
+def parse_bundle(payload, max_requests):
+    """[(path, etag)] from the request body; raises ValueError on malformed input."""
+    entries = (payload or {}).get('requests')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('requests must be a non-empty list')
+    if len(entries) > max_requests:
+        raise ValueError(f'At most {max_requests} requests per bundle')
+
+    parsed = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        path, etag = (entry.get('path'), entry.get('etag')) if isinstance(entry, dict) else (None, None)
+        if not isinstance(path, str) or not path.startswith('/') or not isinstance(etag, (str, type(None))):
+            raise ValueError('Each request must be a path or {"path", "etag"}')
+        parsed.append((path, etag))
+    return parsed
+
+def _identity():
+    """g attributes every sub-request shares: the role profile and read routing."""
+    # Sub-requests are all reads, so they may use the replica like any GET
+    identity = {'db_read_replica': replica_usable(current_app)}
+    role = session.get('role')
+    if role == 'doctor':
+        identity['doctor'] = load_profile(Doctor, 'doctor')
+    elif role == 'patient':
+        identity['patient'] = load_profile(Patient, 'patient')
+    return identity
+
+def _dispatch(app, shared_session, base_url, path, etag):
+    """(status, etag, body bytes or None) of one GET sub-request."""
+    headers = {'If-None-Match': etag} if etag else {}
+    ctx = app.test_request_context(path, base_url=base_url, method='GET', headers=headers)
+    ctx.session = shared_session
+    ctx.push()
+    try:
+        try:
+            response = app.make_response(app.dispatch_request())
+        except HTTPException as e:
+            return e.code, None, dumps({'message': e.description})
+        except Exception:
+            # One failing part must not lose its siblings' results; the session may be shared with them
+            current_app.logger.exception(f"Bundle sub-request {path} failed")
+            db.session.rollback()
+            return 500, None, dumps({'message': 'Internal server error'})
+        if response.status_code == 304:
+            return 304, response.get_etag()[0], None
+        if response.is_streamed or response.mimetype != 'application/json':
+            return 406, None, dumps({'message': 'Only JSON responses can be bundled'})
+        return response.status_code, response.get_etag()[0], response.get_data()
+    finally:
+        ctx.pop()
+
+def _dispatch_in_worker(app, identity, shared_session, base_url, path, etag):
+    with app.app_context():
+        for key, value in identity.items():
+            setattr(g, key, value)
+        return _dispatch(app, shared_session, base_url, path, etag)
+
+def run_bundle(entries):
+    """Runs the parsed sub-requests and returns the combined JSON response."""
+    app = current_app._get_current_object()
+    shared_session = session._get_current_object()
+    base_url = request.host_url
+    identity = _identity()
+
+    workers = min(app.config['BUNDLE_WORKERS'], len(entries))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_dispatch_in_worker, app, identity, shared_session, base_url, path, etag)
+                       for path, etag in entries]
+            results = [future.result() for future in futures]
+    else:
+        for key, value in identity.items():
+            setattr(g, key, value)
+        results = [_dispatch(app, shared_session, base_url, path, etag) for path, etag in entries]
+
+    parts = []
+    for (path, _), (status, etag, body) in zip(entries, results):
+        head = dumps({'path': path, 'status': status, 'etag': etag})
+        parts.append(head[:-1] + b',"body":' + (body.strip() if body else b'null') + b'}')
+    return app.response_class(b'{"responses":[' + b','.join(parts) + b']}', mimetype='application/json')
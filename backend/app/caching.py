@@ -0,0 +1,261 @@
+"""
+Two-tier response cache with versioned keys, and conditional GETs built on the same versions.
+
+Tier 1 is a small per-process LRU bounded by entry count and total bytes; tier 2 is the
+shared Flask-Caching backend (Redis). Every cached view belongs to a namespace whose
+version number is part of the key, so write paths invalidate all of its entries at once
+by bumping the version instead of waiting for a TTL. The version itself is memoised
+locally for CACHE_VERSION_TTL seconds: the writing process sees changes immediately,
+other processes within that window.
+
+Version namespaces in use: 'doctors' and 'patients' (rosters), 'patient:<id>' and
+'doctor:<id>' (one profile; also keys the session profile cache in api/decorators.py) and 'appointments', 'appointments:doctor:<id>', 'appointments:patient:<id>'.
+The same versions back ETags: conditional() answers If-None-Match with 304 after only
+looking up versions, before the view loads any rows. Both decorators run the view on the
+primary database (see app/database.py) so no replica-stale body is stored or tagged. Tags are strong, but compression
+(app/compression.py) weakens them, so If-None-Match is compared weakly.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request, session
+from .database import primary_reads
+from .serialization import wants_ndjson
+
+def patient_namespaces(patient_id):
+    """Namespaces to bump when a patient's profile changes."""
+    return ('patients', f'patient:{patient_id}')
+
+def appointment_namespaces(doctor_id, patient_id):
+    """Namespaces to bump when an appointment of this doctor and patient changes."""
+    return ('appointments', f'appointments:doctor:{doctor_id}', f'appointments:patient:{patient_id}')
+
+class LRUCache:
+    """Thread-safe LRU of bytes-like values with per-entry expiry, bounded by count and size."""
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, size, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None, size=None):
+        size = size if size is not None else len(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._data)
+
+class TieredCache:
+    """Local LRU in front of a Flask-Caching backend, with namespace versioning and hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.local = LRUCache()
+        self.version_ttl = 5
+        self.default_timeout = 3600
+        self._stats = {'local': {'hits': 0, 'misses': 0}, 'redis': {'hits': 0, 'misses': 0, 'errors': 0}}
+        self._stats_lock = threading.Lock()
+
+    def init_app(self, app, backend):
+        self.backend = backend
+        self.local = LRUCache(app.config.get('CACHE_LOCAL_MAX_ENTRIES', 256),
+                              app.config.get('CACHE_LOCAL_MAX_BYTES', 8 * 1024 * 1024))
+        self.version_ttl = app.config.get('CACHE_VERSION_TTL', 5)
+        self.default_timeout = app.config.get('CACHE_VERSIONED_TIMEOUT', 3600)
+
+    def _count(self, tier, outcome):
+        with self._stats_lock:
+            self._stats[tier][outcome] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = {tier: dict(counts) for tier, counts in self._stats.items()}
+        snapshot['local']['entries'] = len(self.local)
+        snapshot['local']['bytes'] = self.local._bytes
+        return snapshot
+
+    # --- Shared backend access: failures degrade to a miss instead of failing the request ---
+    def _backend_get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            current_app.logger.warning(f"Cache backend get failed for {key}: {e}")
+            self._count('redis', 'errors')
+            return None
+
+    def _backend_set(self, key, value, timeout):
+        try:
+            self.backend.set(key, value, timeout=timeout)
+        except Exception as e:
+            current_app.logger.warning(f"Cache backend set failed for {key}: {e}")
+            self._count('redis', 'errors')
+
+    # --- Versioning ---
+    def get_version(self, namespace):
+        version_key = f'version:{namespace}'
+        version = self.local.get(version_key)
+        if version is not None:
+            return version
+
+        version = self._backend_get(version_key)
+        if version is None:
+            # Start from a timestamp so a lost version key can never resurrect old entries
+            version = int(time.time() * 1000)
+            try:
+                self.backend.add(version_key, version, timeout=0)
+            except Exception as e:
+                current_app.logger.warning(f"Cache backend add failed for {version_key}: {e}")
+            version = self._backend_get(version_key) or version
+        self.local.set(version_key, version, timeout=self.version_ttl, size=0)
+        return version
+
+    def get_versions(self, namespaces):
+        """Versions for several namespaces; the ones not memoised locally are fetched in one round trip."""
+        versions = {ns: self.local.get(f'version:{ns}') for ns in namespaces}
+        missing = [ns for ns, v in versions.items() if v is None]
+        if missing:
+            try:
+                fetched = self.backend.get_many(*[f'version:{ns}' for ns in missing])
+            except Exception as e:
+                current_app.logger.warning(f"Cache backend get_many failed: {e}")
+                self._count('redis', 'errors')
+                fetched = [None] * len(missing)
+            for ns, version in zip(missing, fetched):
+                if version is None:
+                    versions[ns] = self.get_version(ns)
+                else:
+                    self.local.set(f'version:{ns}', version, timeout=self.version_ttl, size=0)
+                    versions[ns] = version
+        return versions
+
+    def bump_version(self, *namespaces):
+        """Invalidates every cached entry of the given namespaces. Call after the write commits."""
+        for namespace in namespaces:
+            version_key = f'version:{namespace}'
+            self.local.delete(version_key)
+            try:
+                if self.backend.get(version_key) is None:
+                    self.backend.add(version_key, int(time.time() * 1000), timeout=0)
+                self.backend.cache.inc(version_key)
+            except Exception as e:
+                current_app.logger.warning(f"Cache version bump failed for {namespace}: {e}")
+
+    # --- Values ---
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local', 'hits')
+            return value
+        self._count('local', 'misses')
+
+        value = self._backend_get(key)
+        if value is None:
+            self._count('redis', 'misses')
+            return None
+        self._count('redis', 'hits')
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        timeout = timeout if timeout is not None else self.default_timeout
+        self.local.set(key, value, timeout=timeout)
+        self._backend_set(key, value, timeout)
+
+    def cached(self, namespace, timeout=None, query_string=True):
+        """
+        View decorator like Flask-Caching's cached(), keyed by the namespace version.
+        Only 200 JSON responses are stored; the body is cached as bytes.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                key = f'view:{namespace}:v{self.get_version(namespace)}:{request.path}'
+                if query_string:
+                    key += '?' + '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+
+                body = self.get(key)
+                if body is not None:
+                    return current_app.response_class(body, status=200, mimetype='application/json')
+
+                # Stored under the current version, so it must not come from a lagging replica
+                with primary_reads():
+                    rv = f(*args, **kwargs)
+                response = current_app.make_response(rv)
+                if response.status_code == 200 and response.mimetype == 'application/json':
+                    self.set(key, response.get_data(), timeout)
+                return response
+            return decorated_function
+        return decorator
+
+    def conditional(self, *namespaces):
+        """
+        View decorator for ETags derived from namespace versions. Namespaces may
+        reference the request through format fields, e.g. 'appointments:doctor:{g.doctor.id}'
+        (place it below the role decorators). A matching If-None-Match gets a bodiless 304.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                resolved = [ns.format(g=g, **kwargs) for ns in namespaces]
+                versions = self.get_versions(resolved)
+                raw = '|'.join([
+                    request.path,
+                    '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+                    f"{session.get('role')}:{session.get('user_id')}",
+                    'ndjson' if wants_ndjson() else 'json',
+                ] + [f'{ns}={versions[ns]}' for ns in resolved])
+                etag = hashlib.sha1(raw.encode()).hexdigest()
+
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    # The body is validated by this ETag from now on, so read it from the primary
+                    with primary_reads():
+                        response = current_app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                # Browsers keep the body but must revalidate on every use
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response
+            return decorated_function
+        return decorator
@@ -0,0 +1,74 @@
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+from .bulk_import import IMPORT_KINDS, detect_format, import_users
+from .seed import SEED_BATCH_SIZE, seed_database, seed_email
+from .database import sync_sqlite_replica, touch_replica_heartbeat
+from . import db, tiered_cache
+
+@click.command('import-users')
+@click.argument('kind', type=click.Choice(IMPORT_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+@with_appcontext
+def import_users_command(kind, path, fmt, workers):
+    """Bulk-import doctors or patients from a CSV or NDJSON file."""
+    with open(path, 'rb') as f:
+        report = import_users(kind, f, detect_format(path, None, fmt), workers)
+    if report['created']:
+        tiered_cache.bump_version(kind)
+
+    click.echo(f"Created {report['created']} {kind}, {report['failed']} rows failed.")
+    for error in report['errors']:
+        click.echo(f"  line {error['line']}: {error['email']}: {error['error']}")
+    if report['errors_truncated']:
+        click.echo('  (further errors omitted)')
+
+@click.command('seed')
+@click.option('--doctors', type=int, default=100, show_default=True)
+@click.option('--patients', type=int, default=5000, show_default=True)
+@click.option('--appointments', type=int, default=50000, show_default=True)
+@click.option('--seed', 'random_seed', type=int, default=42, show_default=True, help='Random seed.')
+@click.option('--password', default='password', show_default=True, help='Password for every generated account.')
+@click.option('--anchor', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Date treated as "today" (default: today). Fix it for identical reruns.')
+@click.option('--days-back', type=int, default=365, show_default=True, help='Appointment history window.')
+@click.option('--days-ahead', type=int, default=30, show_default=True, help='Future booking window.')
+@click.option('--batch-size', type=int, default=SEED_BATCH_SIZE, show_default=True)
+@with_appcontext
+def seed_command(doctors, patients, appointments, random_seed, password, anchor, days_back, days_ahead, batch_size):
+    """Generate synthetic doctors, patients, availability, appointments and treatments."""
+    try:
+        summary = seed_database(doctors, patients, appointments, progress=click.echo, seed=random_seed,
+                                password=password, anchor=anchor.date() if anchor else None,
+                                days_back=days_back, days_ahead=days_ahead, batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    # Rosters, appointment listings and the profiles of every generated id (ids may be
+    # reused after a database reset while the shared cache kept its entries)
+    namespaces = ['doctors', 'patients', 'appointments']
+    for doctor_id in summary['doctor_ids']:
+        namespaces += [f'doctor:{doctor_id}', f'appointments:doctor:{doctor_id}']
+    for patient_id in summary['patient_ids']:
+        namespaces += [f'patient:{patient_id}', f'appointments:patient:{patient_id}']
+    tiered_cache.bump_version(*namespaces)
+
+    for table, count in summary['counts'].items():
+        click.echo(f"  {table}: {count} rows")
+    if summary['doctor_ids']:
+        click.echo(f"Accounts use password '{password}', e.g. {seed_email('doctor', summary['doctor_ids'][0])}")
+
+@click.command('sync-replica')
+@with_appcontext
+def sync_replica_command():
+    """Copy the primary SQLite database into the DATABASE_READ_URL file (local replica testing)."""
+    replica_uri = current_app.config.get('DATABASE_READ_URL')
+    if not replica_uri:
+        raise click.ClickException('DATABASE_READ_URL is not set')
+    if db.engine.dialect.name != 'sqlite' or not replica_uri.startswith('sqlite'):
+        raise click.ClickException('sync-replica only copies SQLite databases; use real replication otherwise')
+    # Fresh heartbeat in the copy, so read routing starts using it straight away
+    touch_replica_heartbeat(db)
+    click.echo(f"Replica written to {sync_sqlite_replica(db.engine, replica_uri)}")
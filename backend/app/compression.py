@@ -0,0 +1,65 @@
+"""
+Negotiated compression for JSON and NDJSON responses.
+
+Responses of COMPRESS_MIN_BYTES or more are compressed with brotli when the optional
+`brotli` package is installed and the client accepts br, otherwise with gzip. Streamed
+responses (NDJSON listings) are compressed chunk by chunk with a flush after each one:
+the server never buffers the whole body and the client can decode rows as they arrive.
+
+A compressed body is not byte-identical to the uncompressed one, so a strong ETag set
+by the view is downgraded to a weak one (conditional() compares weakly).
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+def _compressor(encoding, config):
+    """(compress_chunk, finish) pair; compress_chunk flushes so each chunk is decodable."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=config['COMPRESS_BR_QUALITY'])
+        return (lambda chunk: c.process(chunk) + c.flush()), c.finish
+    # wbits 16+MAX_WBITS writes the gzip container
+    c = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda chunk: c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH)), c.flush
+
+def _compress_stream(chunks, compress, finish):
+    for chunk in chunks:
+        if chunk:
+            yield compress(chunk)
+    yield finish()
+
+def init_compression(app):
+    """Registers the compression hook. Call after other after_request hooks that should see the final body."""
+    encodings = ['br', 'gzip'] if brotli else ['gzip']
+
+    @app.after_request
+    def compress_response(response):
+        config = app.config
+        if (not config['COMPRESS_ENABLED'] or response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        if not encoding:
+            return response
+
+        compress, finish = _compressor(encoding, config)
+        if response.is_streamed:
+            response.response = _compress_stream(response.iter_encoded(), compress, finish)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_BYTES']:
+                return response
+            response.set_data(compress(data) + finish())
+        response.headers['Content-Encoding'] = encoding
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,195 @@
+"""
+Database engine configuration and read/write routing.
+
+Engines are configured from the environment (see create_app): DATABASE_URL for the
+primary and, optionally, DATABASE_READ_URL for a read replica. SQLite connections get
+WAL journaling, a busy timeout, the synchronous level and page cache size applied as
+pragmas on every new connection, so readers no longer block behind a writer and
+concurrent writers wait instead of failing with "database is locked". Server databases
+get pool size/overflow/recycle settings instead.
+
+With a replica configured and DATABASE_READ_ROUTING on, GET/HEAD requests run their
+SELECTs on the replica. Anything that writes (a flush or an INSERT/UPDATE/DELETE)
+goes to the primary, and the rest of that request then stays on the primary so it
+reads its own writes. Views that must read fresh data can opt out with @use_primary,
+and code blocks with primary_reads(): profile lookups and the bodies of cached and
+conditional views use it, since a stale read stored under a new cache version would
+outlive the replica's lag.
+
+The primary stamps a one-row heartbeat table every minute (beat) and before each
+sync-replica copy. The replica is only used while its copy of that row is at most
+DATABASE_READ_MAX_LAG seconds old (checked every DATABASE_READ_LAG_CHECK_INTERVAL
+seconds per process); otherwise reads fall back to the primary.
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+READ_BIND = 'replica'
+
+def _is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+def _is_memory(uri):
+    return make_url(uri).database in (None, '', ':memory:')
+
+def engine_options(uri, config):
+    """SQLAlchemy create_engine() options for a database URI from the app config."""
+    if _is_sqlite(uri):
+        # Seconds pysqlite waits on a lock before the busy_timeout pragma is applied
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+def configure_database(app):
+    """Fills in engine options and the replica bind from the (final) app config. Call before db.init_app."""
+    config = app.config
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config['SQLALCHEMY_DATABASE_URI'], config))
+    read_uri = config.get('DATABASE_READ_URL')
+    if read_uri:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(READ_BIND, {'url': read_uri, **engine_options(read_uri, config)})
+        config['SQLALCHEMY_BINDS'] = binds
+    config.setdefault('DATABASE_READ_ROUTING', bool(read_uri))
+
+def _sqlite_pragmas(config, read_only):
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        # Negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}",
+    ]
+    if read_only:
+        pragmas.append('PRAGMA query_only = ON')
+    else:
+        pragmas.insert(0, f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+    return pragmas
+
+def init_engines(app, db):
+    """Registers the per-connection SQLite pragmas on every engine. Call after db.init_app."""
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if engine.dialect.name != 'sqlite' or _is_memory(str(engine.url)):
+                continue
+            pragmas = _sqlite_pragmas(app.config, read_only=(key == READ_BIND))
+
+            def set_pragmas(dbapi_connection, connection_record, pragmas=pragmas):
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+            event.listen(engine, 'connect', set_pragmas)
+
+    if app.config.get('DATABASE_READ_ROUTING') and app.config.get('DATABASE_READ_URL'):
+        app.extensions['replica_lag'] = ReplicaLag(db, app.config['DATABASE_READ_MAX_LAG'],
+                                                   app.config['DATABASE_READ_LAG_CHECK_INTERVAL'])
+
+        @app.before_request
+        def route_reads():
+            g.db_read_replica = request.method in ('GET', 'HEAD') and replica_usable(app)
+
+class ReplicaLag:
+    """Per-process, memoised check of how far the replica's heartbeat row trails the clock."""
+
+    def __init__(self, db, max_lag, interval):
+        self.db = db
+        self.max_lag = max_lag
+        self.interval = interval
+        self._usable = False
+        self._next_check = 0
+
+    def usable(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.interval
+            self._usable = self._measure()
+        return self._usable
+
+    def _measure(self):
+        try:
+            with self.db.engines[READ_BIND].connect() as connection:
+                beat_at = connection.execute(text('SELECT beat_at FROM replica_heartbeat WHERE id = 1')).scalar()
+        except Exception as e:
+            current_app.logger.warning(f"Replica lag check failed, reading from the primary: {e}")
+            return False
+        lag = time.time() - beat_at if beat_at is not None else None
+        if lag is None or lag > self.max_lag:
+            current_app.logger.warning(f"Replica is behind ({'no heartbeat' if lag is None else f'{lag:.0f}s'}), "
+                                       "reading from the primary")
+            return False
+        return True
+
+def replica_usable(app):
+    """True if reads may go to the replica (configured and within DATABASE_READ_MAX_LAG)."""
+    lag = app.extensions.get('replica_lag')
+    return lag is not None and lag.usable()
+
+def touch_replica_heartbeat(db):
+    """Stamps the primary's heartbeat row with the current time and commits."""
+    from .models import ReplicaHeartbeat
+    db.session.merge(ReplicaHeartbeat(id=1, beat_at=time.time()))
+    db.session.commit()
+
+def use_primary(f):
+    """View decorator: keep this GET handler on the primary (e.g. read-after-write flows)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_replica = False
+        return f(*args, **kwargs)
+    return decorated_function
+
+@contextmanager
+def primary_reads():
+    """Runs the block's reads on the primary; the rest of the request keeps its routing."""
+    previous = g.get('db_force_primary', False)
+    g.db_force_primary = True
+    try:
+        yield
+    finally:
+        g.db_force_primary = previous
+
+def _is_read(clause):
+    if isinstance(clause, Select):
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().upper().startswith('SELECT')
+    return False
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends read-only request work to the replica bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('db_read_replica') and not g.get('db_force_primary'):
+            if not self._flushing and _is_read(clause):
+                replica = self._db.engines.get(READ_BIND)
+                if replica is not None:
+                    return replica
+            # First write of the request: stay on the primary from here on
+            g.db_read_replica = False
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def sync_sqlite_replica(primary_engine, replica_uri):
+    """Copies the primary SQLite database into the replica file (online backup API)."""
+    target = make_url(replica_uri).database
+    source = primary_engine.raw_connection()
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            source.driver_connection.backup(destination)
+        finally:
+            destination.close()
+    finally:
+        source.close()
+    return target
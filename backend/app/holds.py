@@ -0,0 +1,329 @@
+"""
+Short-lived slot holds and per-slot waitlists for booking rushes.
+
+Before POST /patient/book touches the database it takes an atomic hold on
+(doctor, date, slot) for SLOT_HOLD_TTL seconds. Everyone else asking for the same slot
+in that window gets a 409 straight from the hold store, without a database round trip.
+The holder's insert still goes through the unique index, which stays the source of
+truth. A failed insert releases the hold; a successful one keeps it until it expires,
+so late arrivals keep being turned away cheaply.
+
+Patients can queue for a taken slot. When an appointment is cancelled, the first
+patient on that slot's waitlist is offered it: the hold is reassigned to them for
+SLOT_OFFER_TTL seconds (only they can book it meanwhile) and, with SLOT_OFFER_NOTIFY
+(on by default with the Redis store), a notification task is queued. Offers are indexed
+by expiry; the reoffer_expired_slots beat task passes one that lapsed unbooked on to
+the next patient in line. While an offer is open, others can still join the queue.
+
+The store is Redis (SET NX PX and small Lua scripts, so every step is atomic across
+workers) or, with SLOT_HOLD_BACKEND = 'memory', a per-process stand-in for tests and
+single-process development; it sweeps expired entries as it is written to. Redis
+errors fail open: bookings fall back to the database
+check instead of failing.
+"""
+import threading
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from flask import current_app
+
+try:
+    import redis
+except ImportError:  # Only needed for the Redis store
+    redis = None
+
+def hold_key(doctor_id, day, time_slot):
+    return f'slot-hold:{doctor_id}:{day.isoformat()}:{time_slot}'
+
+def waitlist_key(doctor_id, day, time_slot):
+    return f'slot-waitlist:{doctor_id}:{day.isoformat()}:{time_slot}'
+
+OFFERS_KEY = 'slot-offers'  # Sorted set of open offers ('doctor|date|slot') by expiry
+OFFERS_PER_SCAN = 100
+SWEEP_INTERVAL = 60  # Seconds between full expiry sweeps of the in-memory store
+
+def offer_id(doctor_id, day, time_slot):
+    return f'{doctor_id}|{day.isoformat()}|{time_slot}'
+
+def parse_offer_id(value):
+    doctor_id, day, time_slot = value.split('|', 2)
+    return int(doctor_id), date.fromisoformat(day), time_slot
+
+class MemoryHoldStore:
+    """In-process stand-in with the same semantics as RedisHoldStore (one process only)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holds = {}  # key -> (owner, expires_at)
+        self._waitlists = {}  # key -> ({owner: joined_at}, expires_at)
+        self._offers = {}  # offer id -> expires_at (wall clock)
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def _sweep(self, now):
+        """Drops expired holds and waitlists, at most once per SWEEP_INTERVAL. Call with the lock held."""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        self._holds = {k: v for k, v in self._holds.items() if v[1] > now}
+        self._waitlists = {k: v for k, v in self._waitlists.items() if v[1] > now}
+
+    def _live_hold(self, key, now):
+        entry = self._holds.get(key)
+        if entry and entry[1] <= now:
+            del self._holds[key]
+            return None
+        return entry
+
+    def _live_waitlist(self, key, now):
+        entry = self._waitlists.get(key)
+        if entry and entry[1] <= now:
+            del self._waitlists[key]
+            return None
+        return entry
+
+    def acquire(self, key, owner, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._live_hold(key, now)
+            if entry and entry[0] != owner:
+                return False
+            self._holds[key] = (owner, now + ttl)
+            return True
+
+    def assign(self, key, owner, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            self._holds[key] = (owner, now + ttl)
+
+    def holder(self, key):
+        with self._lock:
+            entry = self._live_hold(key, time.monotonic())
+            return entry[0] if entry else None
+
+    def holders(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            entries = [self._live_hold(key, now) for key in keys]
+        return [entry[0] if entry else None for entry in entries]
+
+    def release(self, key, owner=None):
+        with self._lock:
+            entry = self._live_hold(key, time.monotonic())
+            if entry and (owner is None or entry[0] == owner):
+                del self._holds[key]
+
+    def wait_add(self, key, owner, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._live_waitlist(key, now)
+            queue = entry[0] if entry else {}
+            queue.setdefault(owner, now)
+            self._waitlists[key] = (queue, now + ttl)
+            return list(queue).index(owner) + 1
+
+    def wait_remove(self, key, owner):
+        with self._lock:
+            entry = self._live_waitlist(key, time.monotonic())
+            if entry:
+                entry[0].pop(owner, None)
+
+    def wait_pop(self, key):
+        with self._lock:
+            entry = self._live_waitlist(key, time.monotonic())
+            if not entry or not entry[0]:
+                return None
+            owner = next(iter(entry[0]))
+            del entry[0][owner]
+            return owner
+
+    def offer_add(self, offer, expires_at):
+        with self._lock:
+            self._offers[offer] = expires_at
+
+    def offer_remove(self, offer):
+        with self._lock:
+            self._offers.pop(offer, None)
+
+    def offers_due(self, now):
+        """Removes and returns offers that expired by `now` (wall clock)."""
+        with self._lock:
+            due = [offer for offer, expires in self._offers.items() if expires <= now][:OFFERS_PER_SCAN]
+            for offer in due:
+                del self._offers[offer]
+            return due
+
+# Hold if free or already ours (refreshing the TTL)
+_ACQUIRE = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+# Delete only if still held by the given owner
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+# Join keeping the original position; returns the 1-based position
+_WAIT_ADD = """
+redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('ZRANK', KEYS[1], ARGV[1]) + 1
+"""
+# Claim offers that expired by ARGV[1], so concurrent scans never pass one on twice
+_OFFERS_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then redis.call('ZREM', KEYS[1], unpack(due)) end
+return due
+"""
+
+class RedisHoldStore:
+    def __init__(self, client):
+        self.client = client
+        self._acquire = client.register_script(_ACQUIRE)
+        self._release = client.register_script(_RELEASE)
+        self._wait_add = client.register_script(_WAIT_ADD)
+        self._offers_due = client.register_script(_OFFERS_DUE)
+
+    def acquire(self, key, owner, ttl):
+        return bool(self._acquire(keys=[key], args=[owner, int(ttl * 1000)]))
+
+    def assign(self, key, owner, ttl):
+        self.client.set(key, owner, px=int(ttl * 1000))
+
+    def holder(self, key):
+        return self.client.get(key)
+
+    def holders(self, keys):
+        return self.client.mget(keys) if keys else []
+
+    def release(self, key, owner=None):
+        if owner is None:
+            self.client.delete(key)
+        else:
+            self._release(keys=[key], args=[owner])
+
+    def wait_add(self, key, owner, ttl):
+        return int(self._wait_add(keys=[key], args=[owner, time.time(), int(ttl)]))
+
+    def wait_remove(self, key, owner):
+        self.client.zrem(key, owner)
+
+    def wait_pop(self, key):
+        popped = self.client.zpopmin(key)
+        return popped[0][0] if popped else None
+
+    def offer_add(self, offer, expires_at):
+        self.client.zadd(OFFERS_KEY, {offer: expires_at})
+
+    def offer_remove(self, offer):
+        self.client.zrem(OFFERS_KEY, offer)
+
+    def offers_due(self, now):
+        return self._offers_due(keys=[OFFERS_KEY], args=[now, OFFERS_PER_SCAN])
+
+class SlotHolds:
+    def __init__(self):
+        self.store = None
+        self.hold_ttl = 30
+        self.offer_ttl = 600
+        self.notify = False
+
+    def init_app(self, app):
+        self.hold_ttl = app.config.get('SLOT_HOLD_TTL', 30)
+        self.offer_ttl = app.config.get('SLOT_OFFER_TTL', 600)
+        backend = app.config.get('SLOT_HOLD_BACKEND')
+        if backend is None:
+            backend = 'redis' if app.config.get('CACHE_TYPE') == 'RedisCache' else 'memory'
+        if backend == 'redis':
+            url = app.config.get('SLOT_HOLD_REDIS_URL') or app.config['CACHE_REDIS_URL']
+            client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1, socket_connect_timeout=1)
+            self.store = RedisHoldStore(client)
+        else:
+            self.store = MemoryHoldStore()
+        notify = app.config.get('SLOT_OFFER_NOTIFY')
+        self.notify = backend == 'redis' if notify is None else notify
+
+    def _call(self, operation, *args, default=None):
+        try:
+            return getattr(self.store, operation)(*args)
+        except Exception as e:
+            current_app.logger.warning(f"Slot hold store {operation} failed: {e}")
+            return default
+
+    # --- Holds ---
+    def hold(self, doctor_id, day, time_slot, patient_id):
+        """True if the patient may go on to insert (holds the slot, or the store is down)."""
+        return self._call('acquire', hold_key(doctor_id, day, time_slot), str(patient_id), self.hold_ttl, default=True)
+
+    def release(self, doctor_id, day, time_slot, patient_id=None):
+        """Drops the hold (only the patient's own, if patient_id is given)."""
+        owner = str(patient_id) if patient_id is not None else None
+        self._call('release', hold_key(doctor_id, day, time_slot), owner)
+
+    def holder(self, doctor_id, day, time_slot):
+        """Patient id holding the slot (booking in flight or open offer), or None."""
+        owner = self._call('holder', hold_key(doctor_id, day, time_slot))
+        return int(owner) if owner is not None else None
+
+    def held(self, slots, patient_id=None):
+        """
+        The (doctor_id, date, time_slot) entries of slots that someone other than patient_id
+        holds (booking in flight or open offer), looked up in one round trip. Empty if the
+        store is unavailable.
+        """
+        slots = list(slots)
+        owners = self._call('holders', [hold_key(*slot) for slot in slots], default=None) or []
+        mine = str(patient_id) if patient_id is not None else None
+        return {slot for slot, owner in zip(slots, owners) if owner is not None and owner != mine}
+
+    def booked(self, doctor_id, day, time_slot):
+        """Call after a booking commits: closes any open offer on the slot."""
+        self._call('offer_remove', offer_id(doctor_id, day, time_slot))
+
+    # --- Waitlist ---
+    def join_waitlist(self, doctor_id, day, time_slot, patient_id):
+        """1-based queue position, or None if the store is unavailable."""
+        # Kept until the day of the slot is over
+        expires = datetime.combine(day + timedelta(days=1), dtime.min)
+        ttl = max(int((expires - datetime.now()).total_seconds()), 60)
+        return self._call('wait_add', waitlist_key(doctor_id, day, time_slot), str(patient_id), ttl)
+
+    def leave_waitlist(self, doctor_id, day, time_slot, patient_id):
+        self._call('wait_remove', waitlist_key(doctor_id, day, time_slot), str(patient_id))
+
+    def slot_freed(self, doctor_id, day, time_slot):
+        """
+        Call after a cancellation commits: offers the slot to the first waitlisted patient
+        (reserving it for them for offer_ttl seconds) and queues their notification.
+        Returns that patient's id, or None.
+        """
+        if day < date.today():
+            return None
+        key = hold_key(doctor_id, day, time_slot)
+        offer = offer_id(doctor_id, day, time_slot)
+        patient_id = self._call('wait_pop', waitlist_key(doctor_id, day, time_slot))
+        if patient_id is None:
+            self._call('release', key)
+            self._call('offer_remove', offer)
+            return None
+        self._call('assign', key, patient_id, self.offer_ttl)
+        self._call('offer_add', offer, time.time() + self.offer_ttl)
+        if self.notify:
+            self._queue_notification(int(patient_id), doctor_id, day, time_slot)
+        return int(patient_id)
+
+    def due_offers(self):
+        """Claims offers whose time ran out: [(doctor_id, date, time_slot)]."""
+        return [parse_offer_id(offer) for offer in self._call('offers_due', time.time(), default=None) or []]
+
+    def _queue_notification(self, patient_id, doctor_id, day, time_slot):
+        from .tasks import notify_slot_offer
+        try:
+            # No publish retries or result tracking: a broker outage must not stall the cancellation
+            notify_slot_offer.apply_async((patient_id, doctor_id, day.isoformat(), time_slot, self.offer_ttl),
+                                          retry=False, ignore_result=True)
+        except Exception as e:
+            current_app.logger.warning(f"Could not queue slot offer notification: {e}")
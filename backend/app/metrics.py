@@ -0,0 +1,216 @@
+"""
+Per-request instrumentation and Prometheus-text metrics.
+
+Every request records its latency (per-endpoint histogram), status, response size,
+the number and total time of SQL statements it issued (SQLAlchemy cursor events) and
+Flask-Caching backend hits/misses. The request's own numbers are returned in a
+Server-Timing header; requests slower than SLOW_REQUEST_MS are logged with the SQL they
+ran, and any statement slower than SLOW_QUERY_MS is logged on its own.
+
+Aggregates are per process (each worker exposes its own), kept in memory under a lock.
+"""
+import threading
+import time
+from collections import defaultdict
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LOGGED_STATEMENTS = 50
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+class _Histogram:
+    __slots__ = ('buckets', 'total', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.total += value
+        self.count += 1
+
+class RequestMetrics:
+    def __init__(self):
+        self.enabled = True
+        self.slow_request = 0.5
+        self.slow_query = 0.1
+        self.server_timing = True
+        self.logger = None
+        self._lock = threading.Lock()
+        self._latency = defaultdict(_Histogram)  # (endpoint, method) -> histogram
+        self._requests = defaultdict(int)  # (endpoint, method, status) -> count
+        self._sql_queries = defaultdict(int)  # endpoint -> statements
+        self._sql_seconds = defaultdict(float)  # endpoint -> seconds
+        self._response_bytes = defaultdict(int)  # endpoint -> bytes
+        self._cache = defaultdict(int)  # 'hit' / 'miss' -> count
+        self._engines = set()
+
+    def init_app(self, app, cache=None):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_request = app.config.get('SLOW_REQUEST_MS', 500) / 1000
+        self.slow_query = app.config.get('SLOW_QUERY_MS', 100) / 1000
+        self.server_timing = app.config.get('SERVER_TIMING_HEADER', True)
+        self.logger = app.logger
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        from . import db
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument_engine(engine)
+        if cache is not None:
+            self.instrument_cache(cache)
+
+    # --- Hooks ---
+    def instrument_engine(self, engine):
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def instrument_cache(self, cache):
+        """Wraps a Flask-Caching Cache's get() to count backend hits and misses."""
+        if getattr(cache.get, 'instrumented', False):
+            return
+        original_get = cache.get
+
+        def get(*args, **kwargs):
+            value = original_get(*args, **kwargs)
+            self._cache_result('hit' if value is not None else 'miss')
+            return value
+        get.instrumented = True
+        cache.get = get
+
+    def _cache_result(self, result):
+        with self._lock:
+            self._cache[result] += 1
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_cache[result] += 1
+
+    # The start time lives on the statement's execution context rather than the connection:
+    # statements that raise skip the after hook (handle_error records them instead) and
+    # must not leave anything behind on a pooled connection
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record(context, statement)
+
+    def _handle_error(self, exception_context):
+        self._record(exception_context.execution_context, exception_context.statement)
+
+    def _record(self, context, statement):
+        start = getattr(context, '_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if elapsed >= self.slow_query:
+            self.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement}")
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_time += elapsed
+            if len(g.metrics_statements) < MAX_LOGGED_STATEMENTS:
+                g.metrics_statements.append((elapsed, statement))
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_statements = []
+        g.metrics_cache = {'hit': 0, 'miss': 0}
+
+    def _after_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unmatched'
+        size = response.content_length if not response.is_streamed else None
+
+        with self._lock:
+            self._latency[(endpoint, request.method)].observe(elapsed)
+            self._requests[(endpoint, request.method, response.status_code)] += 1
+            self._sql_queries[endpoint] += g.metrics_sql_count
+            self._sql_seconds[endpoint] += g.metrics_sql_time
+            if size:
+                self._response_bytes[endpoint] += size
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.2f}, '
+                f'db;dur={g.metrics_sql_time * 1000:.2f};desc="{g.metrics_sql_count} queries", '
+                f'cache;desc="{g.metrics_cache["hit"]} hit {g.metrics_cache["miss"]} miss"'
+            )
+
+        if elapsed >= self.slow_request:
+            statements = '\n'.join(f'  [{t * 1000:.1f} ms] {s}' for t, s in g.metrics_statements)
+            self.logger.warning(
+                f"Slow request {request.method} {request.path} ({endpoint}): {elapsed * 1000:.1f} ms, "
+                f"{g.metrics_sql_count} queries in {g.metrics_sql_time * 1000:.1f} ms\n{statements}"
+            )
+        return response
+
+    # --- Export ---
+    def render(self, extra_cache_stats=None):
+        """Prometheus text exposition (format 0.0.4) of the aggregates."""
+        with self._lock:
+            latency = {k: (list(h.buckets), h.total, h.count) for k, h in self._latency.items()}
+            requests = dict(self._requests)
+            sql_queries, sql_seconds = dict(self._sql_queries), dict(self._sql_seconds)
+            response_bytes, cache = dict(self._response_bytes), dict(self._cache)
+
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by endpoint.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), (buckets, total, count) in sorted(latency.items()):
+            labels = f'endpoint="{_label(endpoint)}",method="{method}"'
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {count}')
+
+        lines += ['# HELP http_requests_total Requests by endpoint and status.', '# TYPE http_requests_total counter']
+        for (endpoint, method, status), n in sorted(requests.items()):
+            lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",method="{method}",status="{status}"}} {n}')
+
+        lines += ['# HELP http_request_sql_queries_total SQL statements issued by endpoint.',
+                  '# TYPE http_request_sql_queries_total counter']
+        for endpoint, n in sorted(sql_queries.items()):
+            lines.append(f'http_request_sql_queries_total{{endpoint="{_label(endpoint)}"}} {n}')
+
+        lines += ['# HELP http_request_sql_seconds_total Time spent in SQL by endpoint.',
+                  '# TYPE http_request_sql_seconds_total counter']
+        for endpoint, seconds in sorted(sql_seconds.items()):
+            lines.append(f'http_request_sql_seconds_total{{endpoint="{_label(endpoint)}"}} {seconds:.6f}')
+
+        lines += ['# HELP http_response_size_bytes_total Response body bytes by endpoint (non-streamed).',
+                  '# TYPE http_response_size_bytes_total counter']
+        for endpoint, n in sorted(response_bytes.items()):
+            lines.append(f'http_response_size_bytes_total{{endpoint="{_label(endpoint)}"}} {n}')
+
+        lines += ['# HELP cache_backend_requests_total Flask-Caching backend lookups by result.',
+                  '# TYPE cache_backend_requests_total counter']
+        for result in ('hit', 'miss'):
+            lines.append(f'cache_backend_requests_total{{result="{result}"}} {cache.get(result, 0)}')
+
+        if extra_cache_stats:
+            lines += ['# HELP tiered_cache_events_total Versioned view cache events by tier.',
+                      '# TYPE tiered_cache_events_total counter']
+            for tier, counts in sorted(extra_cache_stats.items()):
+                for outcome, n in sorted(counts.items()):
+                    if outcome in ('hits', 'misses', 'errors'):
+                        lines.append(f'tiered_cache_events_total{{tier="{tier}",outcome="{outcome}"}} {n}')
+        return '\n'.join(lines) + '\n'
@@ -13,6 +13,11 @@ class User(db.Model):
     doctor_profile = db.relationship('Doctor', backref='user', uselist=False, cascade="all, delete-orphan")
     patient_profile = db.relationship('Patient', backref='user', uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Case-insensitive duplicate checks (bulk import)
+        db.Index('ix_user_email_lower', db.func.lower(email)),
+    )
+
 class Department(db.Model):
     __tablename__ = 'department'
     id = db.Column(db.Integer, primary_key=True)
@@ -28,13 +33,31 @@ class Doctor(db.Model):
     
     name = db.Column(db.String(100), nullable=False)
     specialization_id = db.Column(db.Integer, db.ForeignKey('department.id'))
-    availability_schedule = db.Column(db.Text)  # JSON string for 7-day availability
+    availability_schedule = db.Column(db.Text)  # Legacy JSON schedule, migrated into DoctorAvailability on startup
     is_approved = db.Column(db.Boolean, default=True)  # Admin approval status
     
     # Relationships
     department = db.relationship('Department', backref='doctors_registered')
+    availability = db.relationship('DoctorAvailability', backref='doctor', cascade="all, delete-orphan",
+                                   order_by='(DoctorAvailability.weekday, DoctorAvailability.position)')
     # appointments (accessed via Appointment.doctor)
 
+class DoctorAvailability(db.Model):
+    __tablename__ = 'doctor_availability'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday ... 6 = Sunday
+    time_slot = db.Column(db.String(20), nullable=False)  # Label shown to patients and stored on Appointment
+    start_time = db.Column(db.Time)  # Parsed from the label when possible, used for time-window search
+    end_time = db.Column(db.Time)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Order within the day
+
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'weekday', 'time_slot', name='uq_availability_doctor_day_slot'),
+        db.Index('ix_availability_weekday_start', 'weekday', 'start_time'),
+    )
+
 class Patient(db.Model):
     __tablename__ = 'patient'
     id = db.Column(db.Integer, primary_key=True)
@@ -63,6 +86,17 @@ class Appointment(db.Model):
     doctor = db.relationship('Doctor', backref='appointments')
     treatment = db.relationship('Treatment', backref='appointment', uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Hot lookups: slot check on booking, patient dashboards, daily/admin date scans
+        db.Index('ix_appointment_doctor_date_slot', 'doctor_id', 'date', 'time_slot'),
+        db.Index('ix_appointment_patient_status', 'patient_id', 'status'),
+        db.Index('ix_appointment_date_status', 'date', 'status'),
+        # At most one active (non-cancelled) booking per doctor/date/slot
+        db.Index('uq_appointment_active_slot', 'doctor_id', 'date', 'time_slot', unique=True,
+                 sqlite_where=db.text("status != 'Cancelled'"),
+                 postgresql_where=db.text("status != 'Cancelled'")),
+    )
+
 class Treatment(db.Model):
     __tablename__ = 'treatment'
     id = db.Column(db.Integer, primary_key=True)
@@ -71,4 +105,26 @@ class Treatment(db.Model):
     diagnosis = db.Column(db.Text, nullable=False)
     prescription = db.Column(db.Text, nullable=False)
     notes = db.Column(db.Text)
-    date_created = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DoctorPurge(db.Model):
+    __tablename__ = 'doctor_purge'
+    # No foreign key: the record outlives the doctor row it describes
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    total = db.Column(db.Integer, default=0)  # Appointments to delete
+    deleted = db.Column(db.Integer, default=0)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class StatCounter(db.Model):
+    __tablename__ = 'stat_counter'
+    # e.g. 'doctors', 'appointments:status:Booked', 'appointments:day:2024-05-01'
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeat'
+    # Single row (id 1) stamped on the primary; its age on a replica is that replica's lag
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)  # Unix time
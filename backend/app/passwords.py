@@ -0,0 +1,96 @@
+"""
+Password hashing with configurable parameters and bounded, off-thread verification.
+
+PASSWORD_HASH_METHOD takes any Werkzeug method string with explicit cost parameters
+(e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'). Hashes made with other
+parameters still verify, and are upgraded on the next successful login.
+
+Verification runs in a fixed-size thread pool (hashlib releases the GIL while
+hashing). The calling request thread still blocks until its hash is done, so the
+pool does not free request workers: what it does is cap concurrent hashing at
+PASSWORD_VERIFY_WORKERS (size it to the cores you can give to logins) and bound
+admission. When all workers are busy and the wait queue is full,
+PasswordVerifierBusy is raised immediately so the caller can shed load instead of
+piling up blocked requests. A queued job that does not finish within
+PASSWORD_VERIFY_TIMEOUT raises it too.
+
+The pool is process-wide: repeated init_app calls (one per create_app) reuse it
+while the worker count is unchanged, and it is shut down at interpreter exit.
+"""
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+DEFAULT_SALT_LENGTH = 16
+
+class PasswordVerifierBusy(Exception):
+    """Raised when the verification pool has no free capacity."""
+
+def hash_password_with(method, salt_length, password):
+    # Top-level (no app context) so it can be pickled into process pools
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+def hasher_for_app(app=None):
+    """A picklable single-argument hash function bound to the app's configured parameters."""
+    config = (app or current_app).config
+    return partial(hash_password_with,
+                   config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD),
+                   config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH))
+
+def hash_password(password):
+    return hasher_for_app()(password)
+
+def needs_rehash(stored_hash):
+    """True if the stored hash was made with a method/cost other than the configured one."""
+    method = stored_hash.split('$', 1)[0]
+    return method != current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+
+class PasswordVerifier:
+    def __init__(self):
+        self.executor = None
+        self.timeout = None
+        self._size = None
+        self._slots = None
+
+    def init_app(self, app):
+        workers = app.config.get('PASSWORD_VERIFY_WORKERS') or 4
+        queue = app.config.get('PASSWORD_VERIFY_QUEUE', 64)
+        self.timeout = app.config.get('PASSWORD_VERIFY_TIMEOUT', 10)
+        if self.executor is None:
+            atexit.register(self.shutdown)
+        elif self._size == (workers, queue):
+            return
+        else:
+            self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pwverify')
+        self._size = (workers, queue)
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordVerifierBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # Still queued: drop it; already running: its slot frees when it ends
+            raise PasswordVerifierBusy()
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    def hash(self, password):
+        return self._run(hasher_for_app(), password)
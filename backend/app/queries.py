@@ -0,0 +1,39 @@
+from .models import db, Appointment, Doctor, DoctorPurge, Treatment
+
+def completed_history_query(patient_id):
+    """
+    Completed appointments of a patient that have a treatment record, with the
+    doctor's name and treatment fields joined in (one query, no lazy loads).
+    """
+    return db.session.query(
+        Appointment.id, Appointment.date, Appointment.time_slot,
+        Doctor.name.label('doctor_name'),
+        Treatment.diagnosis, Treatment.prescription, Treatment.notes
+    ).join(Treatment, Treatment.appointment_id == Appointment.id) \
+     .join(Doctor, Appointment.doctor_id == Doctor.id) \
+     .filter(Appointment.patient_id == patient_id, Appointment.status == 'Completed')
+
+def pending_purge_ids():
+    """Subquery of doctor ids that are soft-deleted and waiting for (or undergoing) purge."""
+    return db.select(DoctorPurge.doctor_id).where(DoctorPurge.status != 'done')
+
+def duplicate_active_slots():
+    """[(doctor_id, date, time_slot, [appointment ids])] for slots with more than one active booking."""
+    active = Appointment.status != 'Cancelled'
+    slots = db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time_slot) \
+        .filter(active) \
+        .group_by(Appointment.doctor_id, Appointment.date, Appointment.time_slot) \
+        .having(db.func.count(Appointment.id) > 1).all()
+    # Only ever non-empty on data from before the unique index, so one query per slot is fine
+    return [(doctor_id, day, time_slot, [row.id for row in db.session.query(Appointment.id).filter(
+                active, Appointment.doctor_id == doctor_id, Appointment.date == day,
+                Appointment.time_slot == time_slot).order_by(Appointment.id)])
+            for doctor_id, day, time_slot in slots]
+
+def cancel_duplicate_bookings():
+    """Cancels all but the earliest active booking of each double-booked slot, commits and returns the cancelled ids."""
+    cancelled = [extra for *_, ids in duplicate_active_slots() for extra in ids[1:]]
+    if cancelled:
+        Appointment.query.filter(Appointment.id.in_(cancelled)).update({'status': 'Cancelled'}, synchronize_session=False)
+        db.session.commit()
+    return cancelled
@@ -0,0 +1,57 @@
+"""
+Monthly doctor report rendering (HTML + CSV).
+
+Pure functions: they receive already-aggregated data and write files, so they can run
+in parallel Celery subtasks without touching shared state.
+"""
+import csv
+import html
+import os
+from collections import Counter
+
+REPORT_CSV_HEADER = ['Date', 'Patient', 'Diagnosis', 'Prescription']
+
+def report_paths(reports_dir, period, doctor_id):
+    """Returns (html_path, csv_path) for a doctor's report, creating the period folder."""
+    folder = os.path.join(reports_dir, period)
+    os.makedirs(folder, exist_ok=True)
+    base = os.path.join(folder, f'doctor_{doctor_id}')
+    return base + '.html', base + '.csv'
+
+def render_report_html(summary, treatments, period, top_n=10):
+    """
+    summary: dict with name, total, completed, cancelled
+    treatments: list of (date, patient_name, diagnosis, prescription)
+    """
+    top_diagnoses = Counter(t[2] for t in treatments).most_common(top_n)
+    diagnosis_rows = ''.join(
+        f'<tr><td>{html.escape(d)}</td><td>{n}</td></tr>' for d, n in top_diagnoses
+    )
+    treatment_rows = ''.join(
+        f'<tr><td>{day.isoformat()}</td><td>{html.escape(patient)}</td>'
+        f'<td>{html.escape(diagnosis)}</td><td>{html.escape(prescription)}</td></tr>'
+        for day, patient, diagnosis, prescription in treatments
+    )
+    return (
+        f'<html><head><meta charset="utf-8"><title>Monthly Report - Dr. {html.escape(summary["name"])}</title></head><body>'
+        f'<h1>Monthly Report for Dr. {html.escape(summary["name"])}</h1>'
+        f'<p>Period: {period}</p>'
+        f'<ul><li>Total Appointments: {summary["total"]}</li>'
+        f'<li>Completed: {summary["completed"]}</li>'
+        f'<li>Cancelled: {summary["cancelled"]}</li></ul>'
+        f'<h2>Top Diagnoses</h2><table><tr><th>Diagnosis</th><th>Count</th></tr>{diagnosis_rows}</table>'
+        f'<h2>Treatments</h2><table><tr><th>Date</th><th>Patient</th><th>Diagnosis</th><th>Prescription</th></tr>'
+        f'{treatment_rows}</table></body></html>'
+    )
+
+def write_report(reports_dir, period, summary, treatments):
+    """Writes the HTML and CSV artifacts for one doctor. Returns the HTML path."""
+    html_path, csv_path = report_paths(reports_dir, period, summary['doctor_id'])
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(render_report_html(summary, treatments, period))
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_CSV_HEADER)
+        for day, patient, diagnosis, prescription in treatments:
+            writer.writerow([day.isoformat(), patient, diagnosis, prescription])
+    return html_path
@@ -0,0 +1,289 @@
+"""
+Full-text search (SQLite FTS5): the doctor/patient directory and clinical treatment records.
+
+Directory (trigram tokenizer):
+
+One FTS table holds a row per doctor/patient with name, email and department. The
+rowid encodes the entity (id * 2 for doctors, id * 2 + 1 for patients) so write paths
+can replace a single entry by primary key. The kind column is indexed so doctor searches
+can match it and never walk the (far more numerous) patient entries.
+Searches first require every query word to appear (as a substring, so prefixes match);
+if nothing matches, they fall back to OR-ing the query's trigrams, which ranks
+near-misses and typos by overlap (among the first FUZZY_CANDIDATES matches, so common
+trigrams cannot make a query scan the whole directory). Results are ordered by bm25
+with name weighted over email and department.
+
+Treatments (unicode61 tokenizer, porter stemming): one row per treatment (rowid =
+treatment id) holding diagnosis, prescription and notes plus an indexed owner token
+('doctor<id>'), so a doctor-scoped query is a single index lookup rather than a
+filter over every match. Results page newest first by treatment id (keyset).
+
+On databases without FTS5 the directory helpers degrade to a LIKE prefix search on
+names and treatment search to a LIKE scan.
+"""
+import html
+import re
+from sqlalchemy import text
+from .models import db, Appointment, Doctor, Patient, Treatment
+from .utils import parse_limit
+
+FTS_TABLE = 'directory_fts'
+TREATMENT_FTS_TABLE = 'treatment_fts'
+KIND_OFFSET = {'doctor': 0, 'patient': 1}
+FUZZY_CANDIDATES = 1000  # Fuzzy matches ranked per query
+
+_SOURCE_SQL = {
+    'doctor': (
+        "SELECT doctor.id * 2, 'doctor', doctor.id, doctor.name, user.email, COALESCE(department.name, '') "
+        "FROM doctor JOIN user ON user.id = doctor.user_id "
+        "LEFT JOIN department ON department.id = doctor.specialization_id"
+    ),
+    'patient': (
+        "SELECT patient.id * 2 + 1, 'patient', patient.id, patient.name, user.email, '' "
+        "FROM patient JOIN user ON user.id = patient.user_id"
+    ),
+}
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def ensure_search_index():
+    """Creates the FTS table if needed and builds it when it is empty but the directory is not."""
+    if not fts_enabled():
+        return
+    # Tables from before kind was indexed are rebuilt once
+    definition = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"),
+                                    {'name': FTS_TABLE}).scalar()
+    if definition and 'kind UNINDEXED' in definition:
+        db.session.execute(text(f"DROP TABLE {FTS_TABLE}"))
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "kind, ref_id UNINDEXED, name, email, department, tokenize='trigram')"
+    ))
+    empty = db.session.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {FTS_TABLE})")).scalar()
+    if empty and (Doctor.query.first() or Patient.query.first()):
+        for kind in KIND_OFFSET:
+            index_entities(kind)
+
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TREATMENT_FTS_TABLE} USING fts5("
+        "owner, diagnosis, prescription, notes, tokenize='porter unicode61 remove_diacritics 2')"
+    ))
+    empty = db.session.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {TREATMENT_FTS_TABLE})")).scalar()
+    if empty and Treatment.query.first():
+        index_treatments()
+    db.session.commit()
+
+def index_entities(kind, ids=None):
+    """
+    (Re)indexes the given doctor/patient ids, or all of them when ids is None.
+    Runs in the caller's transaction; does not commit.
+    """
+    if not fts_enabled():
+        return
+    db.session.flush()  # Text statements do not autoflush pending ORM changes
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+        remove_entities(kind, ids)
+        where = f" WHERE {kind}.id IN ({','.join(str(i) for i in ids)})"
+    else:
+        db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid % 2 = :offset"), {'offset': KIND_OFFSET[kind]})
+        where = ''
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, kind, ref_id, name, email, department) {_SOURCE_SQL[kind]}{where}"
+    ))
+
+def remove_entities(kind, ids):
+    if not fts_enabled() or not ids:
+        return
+    rowids = ','.join(str(int(i) * 2 + KIND_OFFSET[kind]) for i in ids)
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({rowids})"))
+
+def search_page_args(args):
+    """Reads q, limit (default 20, max 100), offset and mode. Raises ValueError on bad input."""
+    limit = parse_limit(args.get('limit'), default=20, maximum=100)
+    offset = max(0, int(args.get('offset', 0)))
+    mode = args.get('mode')
+    return args.get('q', ''), limit, offset, mode
+
+def in_rank_order(rows, ids):
+    """Re-orders rows (with an .id attribute) fetched by id to match the search ranking."""
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+def _words(query):
+    return [w for w in re.findall(r'\w+', query.lower())]
+
+def _like_escape(term):
+    """Escapes LIKE wildcards so the term matches literally (use with escape='\\')."""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def _scoped(kind, expression):
+    """
+    Puts the query terms on the text columns. Doctor searches also match the kind token:
+    doctors are a small slice of the directory, so the token skips the patient entries.
+    Patients are nearly all of it; ANDing their token (one entry per patient) costs more
+    than the kind filter in SQL.
+    """
+    expression = f'{{name email department}}:({expression})'
+    return f'kind:{_quote(kind)} AND {expression}' if kind == 'doctor' else expression
+
+def _strict_match(words):
+    return ' AND '.join(_quote(w) for w in words)
+
+def _fuzzy_match(words):
+    trigrams = {w[i:i + 3] for w in words for i in range(len(w) - 2)}
+    return ' OR '.join(_quote(t) for t in sorted(trigrams))
+
+def search_ids(kind, query, limit, offset=0, mode=None, approved_only=False):
+    """
+    Ranked ids of doctors/patients matching query.
+    Returns (ids, mode) where mode is 'exact', 'fuzzy' or 'prefix' (LIKE fallback).
+    Pass the mode of the first page back in for later pages so they page the same result set.
+    approved_only (doctors) filters before paging, so pages are never short.
+    """
+    words = _words(query)
+    if not words:
+        return [], 'exact'
+
+    model = Doctor if kind == 'doctor' else Patient
+    if not fts_enabled() or all(len(w) < 3 for w in words):
+        # Trigram matching needs 3+ characters; short input falls back to a name prefix scan
+        prefix = db.session.query(model.id).filter(model.name.ilike(f'{_like_escape(query.strip())}%', escape='\\'))
+        if approved_only:
+            prefix = prefix.filter(Doctor.is_approved == True)
+        rows = prefix.order_by(model.name, model.id).limit(limit).offset(offset).all()
+        return [r.id for r in rows], 'prefix'
+
+    long_words = [w for w in words if len(w) >= 3]
+    approved = ' AND ref_id IN (SELECT id FROM doctor WHERE is_approved)' if approved_only else ''
+    params = {'kind': kind, 'limit': limit, 'offset': offset}
+    if mode != 'fuzzy':
+        sql = text(
+            f"SELECT ref_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND kind = :kind{approved} "
+            f"ORDER BY bm25({FTS_TABLE}, 0, 0, 10.0, 4.0, 2.0), rowid LIMIT :limit OFFSET :offset"
+        )
+        ids = [r[0] for r in db.session.execute(sql, {**params, 'match': _scoped(kind, _strict_match(long_words))})]
+        if ids or offset or mode == 'exact':
+            return ids, 'exact'
+
+    # Nothing contains every word: rank by trigram overlap to tolerate typos. Common
+    # trigrams match a large share of the directory, so only the first FUZZY_CANDIDATES
+    # matches (in index order) are ranked
+    fuzzy = _fuzzy_match(long_words)
+    if not fuzzy:
+        return [], 'fuzzy'
+    sql = text(
+        f"SELECT ref_id FROM (SELECT ref_id, rowid AS entry, bm25({FTS_TABLE}, 0, 0, 10.0, 4.0, 2.0) AS score "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND kind = :kind{approved} LIMIT :candidates) "
+        "ORDER BY score, entry LIMIT :limit OFFSET :offset"
+    )
+    match = _scoped(kind, fuzzy)
+    return [r[0] for r in db.session.execute(sql, {**params, 'match': match, 'candidates': FUZZY_CANDIDATES})], 'fuzzy'
+
+# --- Treatments ---
+_TREATMENT_SOURCE_SQL = (
+    "SELECT treatment.id, 'doctor' || appointment.doctor_id, treatment.diagnosis, "
+    "treatment.prescription, COALESCE(treatment.notes, '') "
+    "FROM treatment JOIN appointment ON appointment.id = treatment.appointment_id"
+)
+TREATMENT_FIELDS = ('diagnosis', 'prescription', 'notes')
+# Snippet markers that cannot occur in stored text; swapped for <mark> after escaping
+_HL_OPEN, _HL_CLOSE = '\x02', '\x03'
+
+def index_treatments(ids=None):
+    """(Re)indexes the given treatment ids, or all treatments. Does not commit."""
+    if not fts_enabled():
+        return
+    db.session.flush()
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+        id_list = ','.join(str(i) for i in ids)
+        db.session.execute(text(f"DELETE FROM {TREATMENT_FTS_TABLE} WHERE rowid IN ({id_list})"))
+        where = f" WHERE treatment.id IN ({id_list})"
+    else:
+        db.session.execute(text(f"DELETE FROM {TREATMENT_FTS_TABLE}"))
+        where = ''
+    db.session.execute(text(
+        f"INSERT INTO {TREATMENT_FTS_TABLE} (rowid, owner, diagnosis, prescription, notes) "
+        f"{_TREATMENT_SOURCE_SQL}{where}"
+    ))
+
+def remove_doctor_treatments(doctor_id):
+    if not fts_enabled():
+        return
+    db.session.execute(text(
+        f"DELETE FROM {TREATMENT_FTS_TABLE} WHERE rowid IN "
+        f"(SELECT rowid FROM {TREATMENT_FTS_TABLE} WHERE {TREATMENT_FTS_TABLE} MATCH :owner)"
+    ), {'owner': f'owner:{_quote(f"doctor{int(doctor_id)}")}'})
+
+def _highlighted(snippet):
+    return html.escape(snippet).replace(_HL_OPEN, '<mark>').replace(_HL_CLOSE, '</mark>')
+
+def search_treatments(doctor_id, query, limit, before_id=None):
+    """
+    Treatments written by doctor_id matching every word of query (word prefixes match),
+    newest first. Each hit is a dict with treatment/appointment fields and an HTML
+    'snippet' (escaped, matches wrapped in <mark>) from the 'matched_field'. Pass the last id as before_id for
+    the next page.
+    """
+    words = _words(query)
+    if not words:
+        return []
+
+    if not fts_enabled():
+        q = db.session.query(
+            Treatment.id, Treatment.diagnosis, Treatment.prescription, Treatment.notes,
+            Appointment.id.label('appointment_id'), Appointment.date, Patient.id.label('patient_id'),
+            Patient.name.label('patient_name')
+        ).join(Appointment, Treatment.appointment_id == Appointment.id) \
+         .join(Patient, Appointment.patient_id == Patient.id) \
+         .filter(Appointment.doctor_id == doctor_id)
+        for w in words:
+            pattern = f'%{_like_escape(w)}%'
+            q = q.filter(Treatment.diagnosis.ilike(pattern, escape='\\')
+                         | Treatment.prescription.ilike(pattern, escape='\\')
+                         | Treatment.notes.ilike(pattern, escape='\\'))
+        if before_id is not None:
+            q = q.filter(Treatment.id < before_id)
+        return [dict(row._mapping, matched_field='diagnosis', snippet=html.escape(row.diagnosis))
+                for row in q.order_by(Treatment.id.desc()).limit(limit)]
+
+    terms = ' '.join(f'{_quote(w)}*' for w in words)
+    match = f'owner:{_quote(f"doctor{int(doctor_id)}")} AND {{diagnosis prescription notes}}: ({terms})'
+    sql = text(
+        f"SELECT {TREATMENT_FTS_TABLE}.rowid AS id, "
+        + ''.join(f"snippet({TREATMENT_FTS_TABLE}, {i}, :hl_open, :hl_close, '…', 16) AS snippet_{col}, "
+                  for i, col in enumerate(TREATMENT_FIELDS, start=1)) +
+        "treatment.diagnosis, treatment.prescription, treatment.notes, "
+        "appointment.id AS appointment_id, appointment.date, "
+        "patient.id AS patient_id, patient.name AS patient_name "
+        f"FROM {TREATMENT_FTS_TABLE} "
+        f"JOIN treatment ON treatment.id = {TREATMENT_FTS_TABLE}.rowid "
+        "JOIN appointment ON appointment.id = treatment.appointment_id "
+        "JOIN patient ON patient.id = appointment.patient_id "
+        f"WHERE {TREATMENT_FTS_TABLE} MATCH :match"
+        + (f" AND {TREATMENT_FTS_TABLE}.rowid < :before_id" if before_id is not None else "") +
+        f" ORDER BY {TREATMENT_FTS_TABLE}.rowid DESC LIMIT :limit"
+    ).columns(date=db.Date)
+    rows = db.session.execute(sql, {
+        'match': match, 'limit': limit, 'before_id': before_id,
+        'hl_open': _HL_OPEN, 'hl_close': _HL_CLOSE
+    })
+    results = []
+    for row in rows:
+        hit = {k: v for k, v in row._mapping.items() if not k.startswith('snippet_')}
+        # The owner column always matches, so pick the first clinical field with a highlight
+        field = next((f for f in TREATMENT_FIELDS if _HL_OPEN in (row._mapping[f'snippet_{f}'] or '')),
+                     TREATMENT_FIELDS[0])
+        hit['matched_field'] = field
+        hit['snippet'] = _highlighted(row._mapping[f'snippet_{field}'] or '')
+        results.append(hit)
+    return results
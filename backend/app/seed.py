@@ -0,0 +1,236 @@
+"""
+Synthetic data for large local environments (`flask seed`) and benchmarks.
+
+Rows are generated as plain dicts and written with batched Core inserts over a single
+connection (with SQLite's fsync turned off for the duration), so millions of rows load
+in minutes. Every account shares one password hash computed up front. The same seed
+and anchor date always produce the same data.
+
+Distributions:
+- doctors spread over departments with uneven weights; each works 4-6 days a week,
+  on a morning, afternoon or full-day shift of 30-minute slots
+- doctor and patient popularity are skewed (log-normal / Pareto), so some doctors
+  are busy and some patients visit often
+- appointments fall on days the doctor works, never double-book an active slot,
+  and are mostly in the past: Completed (82%), Cancelled (12%) or never closed (6%);
+  future ones are Booked (92%) or Cancelled
+- every completed appointment has a treatment drawn from its department's conditions
+"""
+import random
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, insert, select, text
+from .models import db, User, Doctor, DoctorAvailability, Patient, Department, Appointment, Treatment
+from .passwords import hash_password
+from .search import index_entities, index_treatments
+from .stats import reconcile_counters
+
+SEED_BATCH_SIZE = 10000
+SEED_EMAIL_DOMAIN = 'seed.local'
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Priya', 'Arjun', 'Wei', 'Mei', 'Carlos', 'Sofia', 'Ahmed', 'Fatima', 'Yuki', 'Kenji', 'Olga', 'Ivan']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Patel', 'Shah', 'Gandhi', 'Chen', 'Wang', 'Kim', 'Nguyen', 'Silva', 'Rossi',
+              'Muller', 'Novak', 'Kowalski', 'Haddad', 'Tanaka', 'Sato', 'Okafor', 'Mensah', 'Ivanova']
+SHIFTS = {
+    'morning': [f'{h:02d}:{m:02d}' for h in range(9, 13) for m in (0, 30)],
+    'afternoon': [f'{h:02d}:{m:02d}' for h in range(13, 17) for m in (0, 30)],
+    'full': [f'{h:02d}:{m:02d}' for h in range(9, 17) for m in (0, 30)],
+}
+SLOT_LABELS = SHIFTS['full']
+DEPARTMENT_WEIGHTS = {'Cardiology': 3, 'Dermatology': 2, 'Neurology': 2, 'Orthopedics': 3, 'Pediatrics': 4}
+CONDITIONS = {
+    'Cardiology': [('Hypertension', 'Lisinopril 10mg'), ('Atrial fibrillation', 'Apixaban 5mg'),
+                   ('Hyperlipidemia', 'Atorvastatin 20mg'), ('Stable angina', 'Nitroglycerin 0.4mg')],
+    'Dermatology': [('Eczema', 'Hydrocortisone cream 1%'), ('Acne vulgaris', 'Benzoyl peroxide gel'),
+                    ('Psoriasis', 'Calcipotriol ointment'), ('Contact dermatitis', 'Cetirizine 10mg')],
+    'Neurology': [('Migraine', 'Sumatriptan 50mg'), ('Tension headache', 'Ibuprofen 400mg'),
+                  ('Peripheral neuropathy', 'Gabapentin 300mg'), ('Epilepsy follow-up', 'Levetiracetam 500mg')],
+    'Orthopedics': [('Lower back pain', 'Naproxen 500mg'), ('Sprained ankle', 'Rest, ice, compression'),
+                    ('Osteoarthritis of the knee', 'Paracetamol 1g'), ('Tennis elbow', 'Physiotherapy')],
+    'Pediatrics': [('Otitis media', 'Amoxicillin 250mg'), ('Acute bronchitis', 'Rest and fluids'),
+                   ('Seasonal allergies', 'Loratadine 5mg'), ('Gastroenteritis', 'Oral rehydration salts')],
+}
+GENERIC_CONDITIONS = [('Routine check-up', 'None'), ('Viral infection', 'Rest and fluids')]
+NOTES = ['Follow up in two weeks', 'Patient responding well', 'Refer for lab work', 'Review at next visit']
+
+def seed_email(role, entity_id):
+    return f'{role}{entity_id}@{SEED_EMAIL_DOMAIN}'
+
+def _next_id(conn, model):
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def _weighted_picker(rng, weights):
+    """Fast repeated weighted choice over range(len(weights))."""
+    cumulative, total = [], 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    population = range(len(weights))
+    return lambda k=1: rng.choices(population, cum_weights=cumulative, k=k)
+
+class _Writer:
+    """
+    Buffers rows per table and writes them in batches, committing each batch. When one
+    buffer fills, all are written in first-use order so parent rows land before children.
+    """
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        rows = self.buffers.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for table in self.buffers:
+            rows = self.buffers[table]
+            if rows:
+                self.conn.execute(insert(table), rows)
+                self.conn.commit()
+                self.counts[table.__tablename__] = self.counts.get(table.__tablename__, 0) + len(rows)
+                self.buffers[table] = []
+
+def generate(conn, doctors, patients, appointments, seed=42, password='password', anchor=None,
+             days_back=365, days_ahead=30, batch_size=SEED_BATCH_SIZE, progress=None):
+    """
+    Writes the dataset through `conn` (a SQLAlchemy Connection). Returns a summary with
+    row counts and the id ranges created. Raises ValueError if the date window is too
+    small to place the requested appointments.
+    """
+    rng = random.Random(seed)
+    anchor = anchor or date.today()
+    progress = progress or (lambda message: None)
+    writer = _Writer(conn, batch_size)
+    hashed = hash_password(password)
+
+    departments = conn.execute(select(Department.id, Department.name).order_by(Department.id)).all()
+    if not departments:
+        raise ValueError('No departments to assign doctors to')
+    pick_department = _weighted_picker(rng, [DEPARTMENT_WEIGHTS.get(name, 1) for _, name in departments])
+
+    user_id = _next_id(conn, User)
+    first_doctor, first_patient = _next_id(conn, Doctor), _next_id(conn, Patient)
+    doctor_ids = range(first_doctor, first_doctor + doctors)
+    patient_ids = range(first_patient, first_patient + patients)
+
+    # Doctors, their accounts and weekly availability
+    progress(f'Generating {doctors} doctors...')
+    doctor_department, doctor_schedule = {}, {}
+    for doctor_id in doctor_ids:
+        department_id, department_name = departments[pick_department()[0]]
+        doctor_department[doctor_id] = department_name
+        workdays = sorted(rng.sample(range(5), rng.choice([4, 5, 5])) + ([5] if rng.random() < 0.2 else []))
+        labels = SHIFTS[rng.choices(['morning', 'afternoon', 'full'], weights=[2, 2, 3])[0]]
+        doctor_schedule[doctor_id] = (workdays, labels)
+
+        writer.add(User, {'id': user_id, 'email': seed_email('doctor', doctor_id), 'password': hashed,
+                          'role': 'doctor', 'is_active': True})
+        writer.add(Doctor, {'id': doctor_id, 'user_id': user_id,
+                            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                            'specialization_id': department_id, 'is_approved': rng.random() > 0.02})
+        user_id += 1
+        for weekday in workdays:
+            for position, label in enumerate(labels):
+                hour, minute = map(int, label.split(':'))
+                writer.add(DoctorAvailability, {
+                    'doctor_id': doctor_id, 'weekday': weekday, 'time_slot': label, 'position': position,
+                    'start_time': time(hour, minute),
+                    'end_time': time(hour + (minute + 30) // 60, (minute + 30) % 60),
+                })
+    writer.flush()
+
+    progress(f'Generating {patients} patients...')
+    for patient_id in patient_ids:
+        age_days = int(rng.triangular(0, 95, 40) * 365.25)
+        writer.add(User, {'id': user_id, 'email': seed_email('patient', patient_id), 'password': hashed,
+                          'role': 'patient', 'is_active': True})
+        writer.add(Patient, {'id': patient_id, 'user_id': user_id,
+                             'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                             'dob': anchor - timedelta(days=age_days), 'contact_info': f'555-{patient_id:07d}',
+                             'address': f'{rng.randint(1, 999)} Main Street', 'is_blocked': rng.random() < 0.005})
+        user_id += 1
+    writer.flush()
+
+    # Appointments: a day index per (weekday) bucket so picks land on the doctor's working days
+    first_day = anchor - timedelta(days=days_back)
+    days = [first_day + timedelta(days=i) for i in range(days_back + days_ahead + 1)]
+    days_by_weekday = {w: [i for i, d in enumerate(days) if d.weekday() == w] for w in range(7)}
+    capacity = sum(len(days_by_weekday[w]) * len(labels)
+                   for workdays, labels in doctor_schedule.values() for w in workdays)
+    if appointments and appointments > capacity * 0.8:
+        raise ValueError(f'{appointments} appointments do not fit in {len(days)} days '
+                         f'(capacity {capacity}); widen days_back/days_ahead or add doctors')
+
+    progress(f'Generating {appointments} appointments...')
+    pick_doctor = _weighted_picker(rng, [rng.lognormvariate(0, 0.6) for _ in doctor_ids])
+    pick_patient = _weighted_picker(rng, [rng.paretovariate(1.5) for _ in patient_ids])
+    taken = set()
+    appointment_id, treatment_id = _next_id(conn, Appointment), _next_id(conn, Treatment)
+    placed = 0
+    while placed < appointments:
+        for doctor_index, patient_index in zip(pick_doctor(k=batch_size), pick_patient(k=batch_size)):
+            if placed >= appointments:
+                break
+            doctor_id = first_doctor + doctor_index
+            workdays, labels = doctor_schedule[doctor_id]
+            day_index = rng.choice(days_by_weekday[rng.choice(workdays)])
+            position = rng.randrange(len(labels))
+            key = (doctor_index * len(days) + day_index) * 32 + position
+            if key in taken:
+                continue
+            taken.add(key)
+
+            day = days[day_index]
+            roll = rng.random()
+            if day < anchor:
+                status = 'Completed' if roll < 0.82 else 'Cancelled' if roll < 0.94 else 'Booked'
+            else:
+                status = 'Booked' if roll < 0.92 else 'Cancelled'
+            writer.add(Appointment, {'id': appointment_id, 'patient_id': first_patient + patient_index,
+                                     'doctor_id': doctor_id, 'date': day, 'time_slot': labels[position],
+                                     'status': status})
+            if status == 'Completed':
+                diagnosis, prescription = rng.choice(CONDITIONS.get(doctor_department[doctor_id], GENERIC_CONDITIONS))
+                writer.add(Treatment, {'id': treatment_id, 'appointment_id': appointment_id,
+                                       'diagnosis': diagnosis, 'prescription': prescription,
+                                       'notes': rng.choice(NOTES) if rng.random() < 0.4 else None,
+                                       'date_created': datetime.combine(day, time(*map(int, labels[position].split(':'))))})
+                treatment_id += 1
+            appointment_id += 1
+            placed += 1
+        writer.flush()
+        progress(f'  {placed}/{appointments} appointments')
+
+    return {'counts': writer.counts, 'doctor_ids': doctor_ids, 'patient_ids': patient_ids, 'password': password}
+
+def seed_database(doctors, patients, appointments, progress=None, **options):
+    """
+    Generates the dataset into the app's database (inside an app context), then rebuilds
+    the dashboard counters and search indexes. Returns the summary from generate().
+    """
+    with db.engine.connect() as conn:
+        sqlite = conn.dialect.name == 'sqlite'
+        if sqlite:
+            previous = conn.execute(text('PRAGMA synchronous')).scalar()
+            conn.execute(text('PRAGMA synchronous = OFF'))
+        try:
+            summary = generate(conn, doctors, patients, appointments, progress=progress, **options)
+        finally:
+            if sqlite:
+                conn.execute(text(f'PRAGMA synchronous = {int(previous)}'))
+
+    if progress:
+        progress('Rebuilding counters and search indexes...')
+    reconcile_counters()
+    index_entities('doctor')
+    index_entities('patient')
+    index_treatments()
+    db.session.commit()
+    return summary
@@ -0,0 +1,64 @@
+"""
+Lightweight serialization for list endpoints.
+
+List handlers select only the columns they return, so SQLAlchemy yields plain row
+tuples with no ORM identity-map work. records() zips them with the JSON key names in
+column order, and json_response() encodes the payload with orjson when it is installed
+(dates and datetimes natively as ISO 8601), otherwise with the stdlib encoder in
+compact form. Put defaults and renames in the SELECT (coalesce, label) rather than in
+Python loops.
+
+Large listings can also be streamed as NDJSON (one object per line) when the client
+asks for it with ?stream=1 or Accept: application/x-ndjson. ndjson_response() runs the
+query with yield_per (a server-side cursor where the driver has one) and encodes each
+batch as it arrives, so neither the rows nor the body are held in memory at once.
+"""
+import json
+from datetime import date, datetime, time
+from flask import current_app, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib encoder is used instead
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson else 'json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+def _default(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(payload):
+    """Encodes to compact JSON bytes."""
+    if orjson:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+def records(rows, fields):
+    """Dicts from result tuples; `fields` are the JSON keys in the rows' column order."""
+    return [dict(zip(fields, row)) for row in rows]
+
+def json_response(payload, status=200):
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+def wants_ndjson():
+    """True for ?stream=1, or when the Accept header prefers NDJSON over JSON."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    accept = request.accept_mimetypes
+    return accept.quality(NDJSON_MIMETYPE) > accept.quality('application/json')
+
+def ndjson_response(query, fields, batch_size=None):
+    """Streams a column query as NDJSON, `fields` naming the columns in order."""
+    batch_size = batch_size or current_app.config['STREAM_BATCH_SIZE']
+    result = query.session.execute(query.statement, execution_options={'yield_per': batch_size})
+
+    def generate():
+        try:
+            for batch in result.partitions():
+                yield b''.join(dumps(dict(zip(fields, row))) + b'\n' for row in batch)
+        finally:
+            result.close()
+    return current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,191 @@
+"""
+Doctor availability and the free-slot engine.
+
+A doctor's availability is a weekly template stored as DoctorAvailability rows:
+weekday -> ordered list of time slot labels. For every (doctor, date) in a range the
+slots are held as a bitmask over that weekday's labels, so marking booked slots and
+extracting the free ones is integer arithmetic. Templates and bookings for all the
+requested doctors are each fetched with one query. Slots that already started today
+and slots held in the slot hold store (a booking in flight or an open waitlist offer)
+are not free either; the holds are checked in one batch.
+"""
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from .models import db, Appointment, Doctor, DoctorAvailability
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def parse_schedule(raw):
+    """
+    Normalises a stored availability schedule into {weekday index: [slot labels]}.
+    Accepts the JSON text stored on Doctor or an already-decoded dict; anything else is empty.
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return {}
+    if not isinstance(raw, dict):
+        return {}
+
+    template = {}
+    for day, labels in raw.items():
+        if day in WEEKDAYS and isinstance(labels, list):
+            # dict.fromkeys de-duplicates while keeping the doctor's ordering
+            template[WEEKDAYS.index(day)] = list(dict.fromkeys(str(l) for l in labels))
+    return template
+
+_TIME_RE = re.compile(r'(\d{1,2})(?::(\d{2}))?\s*([AaPp][Mm])?')
+
+def _to_time(match):
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return time(hour, minute)
+
+def parse_slot_times(label):
+    """
+    Best-effort (start, end) times for a slot label such as '09:00', '9:30 AM' or
+    '09:00-10:00'. Unparseable parts are None; the label itself is always kept as-is.
+    """
+    matches = [m for m in _TIME_RE.finditer(label) if m.group(2) or m.group(3)]
+    times = [_to_time(m) for m in matches[:2]]
+    start = times[0] if times else None
+    end = times[1] if len(times) > 1 else None
+    return start, end
+
+def replace_schedule(doctor_id, schedule):
+    """
+    Replaces a doctor's availability rows with the given schedule (JSON text or
+    {weekday name: [labels]}). Does not commit. Returns the number of slots written.
+    """
+    template = parse_schedule(schedule)
+    DoctorAvailability.query.filter_by(doctor_id=doctor_id).delete()
+
+    rows = []
+    for weekday, labels in template.items():
+        for position, label in enumerate(labels):
+            start, end = parse_slot_times(label)
+            rows.append(DoctorAvailability(doctor_id=doctor_id, weekday=weekday, time_slot=label,
+                                           start_time=start, end_time=end, position=position))
+    db.session.add_all(rows)
+    return len(rows)
+
+def load_templates(doctor_ids):
+    """Returns {doctor_id: {weekday index: [labels]}} for the given doctors in one query."""
+    templates = {doc_id: {} for doc_id in doctor_ids}
+    if not doctor_ids:
+        return templates
+
+    rows = db.session.query(DoctorAvailability.doctor_id, DoctorAvailability.weekday, DoctorAvailability.time_slot) \
+        .filter(DoctorAvailability.doctor_id.in_(doctor_ids)) \
+        .order_by(DoctorAvailability.doctor_id, DoctorAvailability.weekday, DoctorAvailability.position).all()
+    for doc_id, weekday, label in rows:
+        templates[doc_id].setdefault(weekday, []).append(label)
+    return templates
+
+def template_to_schedule(template):
+    """Converts {weekday index: [labels]} back into the {weekday name: [labels]} API shape."""
+    return {WEEKDAYS[wd]: labels for wd, labels in sorted(template.items())}
+
+def available_doctor_ids(weekday, time_from=None, time_to=None):
+    """
+    Subquery of doctor ids with at least one slot on the weekday whose start time falls
+    within [time_from, time_to). Backed by ix_availability_weekday_start.
+    """
+    query = db.select(DoctorAvailability.doctor_id).where(DoctorAvailability.weekday == weekday)
+    if time_from is not None:
+        query = query.where(DoctorAvailability.start_time >= time_from)
+    if time_to is not None:
+        query = query.where(DoctorAvailability.start_time < time_to)
+    return query
+
+def migrate_legacy_schedules():
+    """
+    One-off migration: moves JSON availability_schedule blobs into DoctorAvailability
+    rows and clears the JSON so it is never re-imported. Returns the number of doctors migrated.
+    """
+    doctors = Doctor.query.filter(Doctor.availability_schedule.isnot(None)).all()
+    for doc in doctors:
+        replace_schedule(doc.id, doc.availability_schedule)
+        doc.availability_schedule = None
+    if doctors:
+        db.session.commit()
+    return len(doctors)
+
+def booked_slots(doctor_ids, start, end):
+    """
+    Returns {(doctor_id, date): set(time_slot)} for every non-cancelled appointment
+    of the given doctors within [start, end], in a single query.
+    """
+    taken = defaultdict(set)
+    if not doctor_ids:
+        return taken
+
+    rows = db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time_slot).filter(
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.date >= start,
+        Appointment.date <= end,
+        Appointment.status != 'Cancelled'
+    ).all()
+    for doctor_id, day, slot in rows:
+        taken[(doctor_id, day)].add(slot)
+    return taken
+
+def _started_mask(labels, now):
+    """Bitmask of the labels whose start time is not after `now` (unparseable labels never are)."""
+    mask = 0
+    for i, label in enumerate(labels):
+        start = parse_slot_times(label)[0]
+        if start is not None and start <= now:
+            mask |= 1 << i
+    return mask
+
+def free_slots(doctor_ids, start, end, patient_id=None):
+    """
+    Computes open slots for many doctors at once, leaving out days before today, slots
+    that already started today and slots held by anyone but patient_id.
+    Returns {doctor_id: {'YYYY-MM-DD': [free slot labels]}}; days without free slots are omitted.
+    """
+    from . import slot_holds
+
+    now = datetime.now()
+    today = now.date()
+    start = max(start, today)
+    templates = load_templates(doctor_ids)
+    taken = booked_slots([doc_id for doc_id, t in templates.items() if t], start, end)
+
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    result, candidates = {}, []
+    for doc_id, template in templates.items():
+        # Bit positions per weekday, built once per doctor rather than per day
+        positions = {wd: {label: i for i, label in enumerate(labels)} for wd, labels in template.items()}
+        doctor_days = {}
+        for day in days:
+            labels = template.get(day.weekday())
+            if not labels:
+                continue
+            free_mask = (1 << len(labels)) - 1
+            if day == today:
+                free_mask &= ~_started_mask(labels, now.time())
+            for slot in taken.get((doc_id, day), ()):
+                bit = positions[day.weekday()].get(slot)
+                if bit is not None:
+                    free_mask &= ~(1 << bit)
+            if free_mask:
+                free = [l for i, l in enumerate(labels) if free_mask >> i & 1]
+                doctor_days[day.isoformat()] = free
+                candidates.extend((doc_id, day, label) for label in free)
+        result[doc_id] = doctor_days
+
+    for doc_id, day, label in slot_holds.held(candidates, patient_id):
+        doctor_days = result[doc_id]
+        free = doctor_days[day.isoformat()]
+        free.remove(label)
+        if not free:
+            del doctor_days[day.isoformat()]
+    return result
@@ -0,0 +1,148 @@
+"""
+Incrementally maintained dashboard counters.
+
+Write handlers adjust StatCounter rows inside their own transaction, so a counter
+changes exactly when the data it describes commits. reconcile_counters() recomputes
+everything from the base tables to correct any drift (run periodically by Celery),
+applying the difference as increments so it never overwrites concurrent updates.
+"""
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import func, literal, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import db, Doctor, Patient, Appointment, StatCounter
+
+APPOINTMENT_STATUSES = ['Booked', 'Completed', 'Cancelled']
+
+def status_key(status):
+    return f'appointments:status:{status}'
+
+def day_key(day):
+    return f'appointments:day:{day.isoformat()}'
+
+UPSERT_DIALECTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+def adjust_counters(deltas):
+    """
+    Applies {counter name: delta} as atomic SQL increments in the current transaction. Does not commit.
+    One INSERT ... ON CONFLICT DO UPDATE creates missing counters, so concurrent first
+    increments (e.g. a new day's counter) cannot collide on the primary key.
+    """
+    rows = [{'name': name, 'value': delta} for name, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    insert = UPSERT_DIALECTS.get(db.session.get_bind(StatCounter.__mapper__).dialect.name)
+    if insert is None:
+        # No portable upsert: update, then create counters that did not exist yet
+        for row in rows:
+            result = db.session.execute(db.update(StatCounter).where(StatCounter.name == row['name'])
+                                        .values(value=StatCounter.value + row['value']))
+            if not result.rowcount:
+                db.session.add(StatCounter(**row))
+        return
+    statement = insert(StatCounter).values(rows)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[StatCounter.name], set_={'value': StatCounter.value + statement.excluded.value}))
+
+def appointment_deltas(day, old_status, new_status):
+    """
+    Counter deltas for an appointment moving between statuses (None means created/deleted).
+    The per-day load counts every non-cancelled appointment on that date.
+    """
+    deltas = {}
+    if old_status is None:
+        deltas['appointments'] = 1
+    if new_status is None:
+        deltas['appointments'] = -1
+    if old_status:
+        deltas[status_key(old_status)] = deltas.get(status_key(old_status), 0) - 1
+    if new_status:
+        deltas[status_key(new_status)] = deltas.get(status_key(new_status), 0) + 1
+
+    was_active = old_status is not None and old_status != 'Cancelled'
+    is_active = new_status is not None and new_status != 'Cancelled'
+    if was_active != is_active:
+        deltas[day_key(day)] = 1 if is_active else -1
+    return deltas
+
+def record_appointment_change(day, old_status, new_status):
+    if old_status != new_status:
+        adjust_counters(appointment_deltas(day, old_status, new_status))
+
+def record_appointments_deleted(groups):
+    """Counter updates for a set-based delete; groups are (date, status, count) rows."""
+    deltas = defaultdict(int)
+    for day, status, count in groups:
+        for name, delta in appointment_deltas(day, status, None).items():
+            deltas[name] += delta * count
+    adjust_counters(deltas)
+
+def read_dashboard_stats(today=None):
+    """Reads the dashboard statistics with a single primary-key lookup query."""
+    today = today or date.today()
+    names = ['doctors', 'patients', 'appointments', day_key(today)] + [status_key(s) for s in APPOINTMENT_STATUSES]
+    values = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(names)).all())
+    return {
+        'doctors': values.get('doctors', 0),
+        'patients': values.get('patients', 0),
+        'appointments': values.get('appointments', 0),
+        'appointments_by_status': {s: values.get(status_key(s), 0) for s in APPOINTMENT_STATUSES},
+        'today': values.get(day_key(today), 0)
+    }
+
+def _counter_snapshot(today):
+    """
+    (expected, current) counter values. One UNION ALL statement reads the base-table
+    aggregates and the stored counters, so both come from the same snapshot.
+    """
+    day = db.cast(Appointment.date, db.String)
+    statement = union_all(
+        db.select(literal('expected'), literal('doctors'), func.count(Doctor.id)),
+        db.select(literal('expected'), literal('patients'), func.count(Patient.id)),
+        db.select(literal('expected'), literal('appointments'), func.count(Appointment.id)),
+        db.select(literal('status'), Appointment.status, func.count(Appointment.id)).group_by(Appointment.status),
+        db.select(literal('day'), day, func.count(Appointment.id))
+            .where(Appointment.date >= today, Appointment.status != 'Cancelled').group_by(Appointment.date),
+        db.select(literal('current'), StatCounter.name, StatCounter.value),
+    )
+    expected = {status_key(s): 0 for s in APPOINTMENT_STATUSES}
+    current = {}
+    for source, name, value in db.session.execute(statement):
+        if source == 'current':
+            current[name] = value
+        elif source == 'status':
+            if name:
+                expected[status_key(name)] = value
+        elif source == 'day':
+            expected[f'appointments:day:{name}'] = value
+        else:
+            expected[name] = value
+    return expected, current
+
+def reconcile_counters(today=None):
+    """
+    Recomputes every counter from the base tables and commits. Corrections are applied as
+    deltas through adjust_counters(), so increments that commit while this runs are kept.
+    Per-day load counters are kept from today onwards; older ones are dropped. Returns the
+    number of counters corrected.
+    """
+    today = today or date.today()
+    expected, current = _counter_snapshot(today)
+
+    stale = []
+    for name, value in current.items():
+        if name in expected or not name.startswith(('appointments:day:', 'appointments:status:')):
+            continue
+        if name.startswith('appointments:day:') and name < day_key(today):
+            stale.append(name)
+        else:
+            expected[name] = 0
+
+    # Missing counters read as 0, so only non-zero differences are written
+    deltas = {name: value - current.get(name, 0) for name, value in expected.items() if value != current.get(name, 0)}
+    adjust_counters(deltas)
+    if stale:
+        StatCounter.query.filter(StatCounter.name.in_(stale)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(deltas) + len([name for name in stale if current[name]])
@@ -0,0 +1,66 @@
+import base64
+import threading
+from datetime import datetime
+from sqlalchemy import event
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD string into a date. Raises ValueError on bad input."""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def parse_time(value):
+    """Parses an HH:MM string into a time. Raises ValueError on bad input."""
+    return datetime.strptime(value, '%H:%M').time()
+
+def encode_cursor(*parts):
+    """
+    Encodes the sort key of the last row on a page into an opaque, URL-safe cursor.
+    Dates are stored as ISO strings, everything else via str().
+    """
+    raw = '|'.join(p.isoformat() if hasattr(p, 'isoformat') else str(p) for p in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Reverses encode_cursor, returning the raw string parts. Raises ValueError on bad input."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        return base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def parse_limit(value, default=50, maximum=200):
+    """Clamps a page size query arg to [1, maximum]. Raises ValueError on non-integers."""
+    if value is None:
+        return default
+    return max(1, min(int(value), maximum))
+
+class QueryCounter:
+    """
+    Context manager that counts SQL statements issued on the current thread.
+    Usage: with QueryCounter() as qc: ...; qc.count
+    """
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+        self._thread_id = threading.get_ident()
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread_id:
+            self.count += 1
+            self.statements.append(statement)
+
+    def __enter__(self):
+        if self.engine is None:
+            # Every bind, so reads routed to a replica are counted too
+            from . import db
+            self._engines = list(db.engines.values())
+        else:
+            self._engines = [self.engine]
+        for engine in self._engines:
+            event.listen(engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._on_execute)
+        return False
@@ -0,0 +1,350 @@
+"""
+Endpoint benchmark: latency percentiles, booking throughput and memory per request.
+
+    python benchmarks/bench_endpoints.py --scale small --output results.json
+    python benchmarks/bench_endpoints.py --doctors 1000 --patients 100000 --appointments 1000000
+
+Builds the app with create_app() against a fresh SQLite file and an in-process cache
+(SimpleCache instead of Redis), loads a synthetic dataset (app.seed), then drives the endpoints
+through the Flask test client. Prints JSON (and optionally writes it to --output) so
+runs can be diffed across changes.
+
+Scenarios:
+  patient_doctors     GET /patient/doctors, rotating filters (versioned cache in front)
+  doctor_slots        GET /patient/doctors/<id>/slots for random doctors
+  doctor_dashboard    GET /doctor/dashboard as a pool of doctors
+  admin_appointments  GET /admin/appointments, walking pages by cursor
+  book                POST /patient/book from --concurrency threads (some slots contended);
+                      conflicts are split into slot-hold rejections and database conflicts
+
+The "serialization" section compares encoding --serialization-rows appointment rows
+the old way (ORM entities, per-row dicts, jsonify) against the column-projected path
+the list endpoints use (result tuples, records(), app.serialization.dumps), reporting
+per-row CPU time and peak traced memory for each.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import queue
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify
+from sqlalchemy.orm import joinedload
+from app import create_app, db
+from app.models import Appointment, Doctor, Patient
+from app.serialization import JSON_BACKEND, dumps, records
+from app.seed import SLOT_LABELS, seed_database, seed_email
+
+SCALES = {
+    'tiny': (20, 500, 5000),
+    'small': (100, 5000, 50000),
+    'medium': (300, 30000, 300000),
+    'large': (1000, 100000, 1000000),
+}
+SCENARIOS = ('patient_doctors', 'doctor_slots', 'doctor_dashboard', 'admin_appointments', 'book')
+CLIENT_POOL = 20
+
+def percentiles(samples):
+    """Latency summary in milliseconds (nearest-rank percentiles)."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        'p50': round(rank(50) * 1000, 3),
+        'p90': round(rank(90) * 1000, 3),
+        'p99': round(rank(99) * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3),
+        'mean': round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+def logged_in_client(app, email, password):
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': email, 'password': password})
+    if response.status_code != 200:
+        raise RuntimeError(f'Login failed for {email}: {response.status_code}')
+    return client
+
+class Scenario:
+    """Yields (client, method, path, json body) for each request of a benchmark scenario."""
+
+    def __init__(self, app, data, rng):
+        self.app, self.data, self.rng = app, data, rng
+        self.admin = logged_in_client(app, 'admin@hospital.com', 'admin123')
+        self.patients = [logged_in_client(app, seed_email('patient', i), data['password'])
+                         for i in rng.sample(data['patient_ids'], min(CLIENT_POOL, len(data['patient_ids'])))]
+        self.doctors = [logged_in_client(app, seed_email('doctor', i), data['password'])
+                        for i in rng.sample(data['doctor_ids'], min(CLIENT_POOL, len(data['doctor_ids'])))]
+        self._cursor = None
+
+    def patient_doctors(self):
+        query = self.rng.choice(['', '?day=Monday', '?day=Friday&time_from=09:00&time_to=12:00'])
+        return self.rng.choice(self.patients), 'GET', f'/patient/doctors{query}', None
+
+    def doctor_slots(self):
+        doctor_id = self.rng.choice(self.data['doctor_ids'])
+        return self.rng.choice(self.patients), 'GET', f'/patient/doctors/{doctor_id}/slots', None
+
+    def doctor_dashboard(self):
+        return self.rng.choice(self.doctors), 'GET', '/doctor/dashboard', None
+
+    def admin_appointments(self):
+        path = '/admin/appointments?limit=50'
+        if self._cursor:
+            path += f'&cursor={self._cursor}'
+        return self.admin, 'GET', path, None
+
+    def after_admin_appointments(self, response):
+        self._cursor = (response.get_json() or {}).get('next_cursor')
+
+def send(client, method, path, body):
+    if method == 'GET':
+        return client.get(path)
+    return client.open(path, method=method, json=body)
+
+def run_latency(scenario, name, requests, warmup):
+    make = getattr(scenario, name)
+    after = getattr(scenario, f'after_{name}', None)
+    for _ in range(warmup):
+        response = send(*make())
+        if after:
+            after(response)
+
+    samples, statuses = [], {}
+    started = time.perf_counter()
+    for _ in range(requests):
+        args = make()
+        t0 = time.perf_counter()
+        response = send(*args)
+        samples.append(time.perf_counter() - t0)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if after:
+            after(response)
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'status_counts': {str(k): v for k, v in sorted(statuses.items())},
+        'latency_ms': percentiles(samples),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+    }
+
+def run_memory(scenario, name, samples):
+    """Peak Python heap growth (KiB) while serving single requests, via tracemalloc."""
+    make = getattr(scenario, name)
+    after = getattr(scenario, f'after_{name}', None)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            args = make()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            response = send(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            if after:
+                after(response)
+    finally:
+        tracemalloc.stop()
+    return {'mean_peak_kib': round(statistics.fmean(peaks) / 1024, 1), 'max_peak_kib': round(max(peaks) / 1024, 1)}
+
+def _orm_listing(limit):
+    rows = Appointment.query.options(joinedload(Appointment.patient), joinedload(Appointment.doctor)) \
+        .order_by(Appointment.id).limit(limit).all()
+    return jsonify([{
+        'id': a.id, 'date': a.date.isoformat(), 'time_slot': a.time_slot, 'status': a.status,
+        'patient_name': a.patient.name, 'doctor_name': a.doctor.name,
+    } for a in rows]).get_data()
+
+def _projected_listing(limit):
+    rows = db.session.query(
+        Appointment.id, Appointment.date, Appointment.time_slot, Appointment.status,
+        Patient.name, Doctor.name
+    ).join(Patient, Appointment.patient_id == Patient.id) \
+     .join(Doctor, Appointment.doctor_id == Doctor.id) \
+     .order_by(Appointment.id).limit(limit).all()
+    return dumps(records(rows, ('id', 'date', 'time_slot', 'status', 'patient_name', 'doctor_name')))
+
+def run_serialization(app, rows, repeats=5):
+    """Per-row CPU time (best of `repeats`) and peak traced memory of both listing paths."""
+    result = {'rows': rows, 'json_backend': JSON_BACKEND}
+    with app.app_context():
+        for name, build in (('orm', _orm_listing), ('projected', _projected_listing)):
+            timings = []
+            for _ in range(repeats):
+                db.session.expunge_all()
+                started = time.process_time()
+                body = build(rows)
+                timings.append(time.process_time() - started)
+            count = max(len(json.loads(body)), 1)
+            db.session.expunge_all()
+            tracemalloc.start()
+            try:
+                build(rows)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            result[name] = {
+                'cpu_us_per_row': round(min(timings) / count * 1e6, 2),
+                'peak_bytes_per_row': round(peak / count),
+                'body_bytes': len(body),
+            }
+            db.session.remove()
+    orm, projected = result['orm'], result['projected']
+    result['savings'] = {
+        'cpu_pct': round(100 * (1 - projected['cpu_us_per_row'] / orm['cpu_us_per_row']), 1),
+        'memory_pct': round(100 * (1 - projected['peak_bytes_per_row'] / orm['peak_bytes_per_row']), 1),
+    }
+    return result
+
+def run_booking(app, data, rng, requests, concurrency, hot_ratio):
+    """
+    Concurrent bookings on future weekdays beyond the dataset's range. A share of the
+    requests (hot_ratio) target a small set of slots so the conflict path is exercised.
+    """
+    clients = [logged_in_client(app, seed_email('patient', i), data['password'])
+               for i in rng.sample(data['patient_ids'], min(concurrency, len(data['patient_ids'])))]
+    first_day = date.today() + timedelta(days=400)
+    days = [first_day + timedelta(days=i) for i in range(60) if (first_day + timedelta(days=i)).weekday() < 5]
+    hot = [(rng.choice(data['doctor_ids']), rng.choice(days), rng.choice(SLOT_LABELS)) for _ in range(10)]
+    plan = [rng.choice(hot) if rng.random() < hot_ratio
+            else (rng.choice(data['doctor_ids']), rng.choice(days), rng.choice(SLOT_LABELS))
+            for _ in range(requests)]
+
+    samples, statuses, held, lock = [], {}, [0], threading.Lock()
+    # Test clients keep a cookie jar, so each one is used by a single thread at a time
+    idle = queue.Queue()
+    for client in clients:
+        idle.put(client)
+
+    def worker(index):
+        client = idle.get()
+        doctor_id, day, slot = plan[index]
+        t0 = time.perf_counter()
+        try:
+            response = client.post('/patient/book', json={'doctor_id': doctor_id, 'date': day.isoformat(),
+                                                          'time_slot': slot})
+            code = response.status_code
+        except Exception:
+            code = 'exception'
+        elapsed = time.perf_counter() - t0
+        idle.put(client)
+        with lock:
+            samples.append(elapsed)
+            statuses[code] = statuses.get(code, 0) + 1
+            if code == 409 and 'another patient' in response.get_json()['message']:
+                held[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'status_counts': {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+        'booked': statuses.get(201, 0),
+        'conflicts': statuses.get(409, 0),
+        'rejected_by_hold': held[0],  # Turned away before touching the database
+        'latency_ms': percentiles(samples),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--doctors', type=int, help='Overrides the scale preset')
+    parser.add_argument('--patients', type=int, help='Overrides the scale preset')
+    parser.add_argument('--appointments', type=int, help='Overrides the scale preset')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset to run')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--memory-samples', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help='Booking threads')
+    parser.add_argument('--hot-ratio', type=float, default=0.2, help='Share of bookings aimed at contended slots')
+    parser.add_argument('--serialization-rows', type=int, default=5000,
+                        help='Rows for the serialization comparison (0 skips it)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='SQLite file to use (default: a temporary file, removed afterwards)')
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+    doctors, patients, appointments = SCALES[args.scale]
+    doctors = args.doctors if args.doctors is not None else doctors
+    patients = args.patients if args.patients is not None else patients
+    appointments = args.appointments if args.appointments is not None else appointments
+
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.TemporaryDirectory(prefix='hms-bench-')
+        db_path = os.path.join(tmpdir.name, 'bench.db')
+
+    # Startup messages go to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(db_path)}',
+            'CACHE_TYPE': 'SimpleCache',
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1',  # Logins are not what is being measured
+        })
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        started = time.perf_counter()
+        data = seed_database(doctors, patients, appointments, seed=args.seed)
+        seed_seconds = time.perf_counter() - started
+
+    result = {
+        'config': {
+            'doctors': doctors, 'patients': patients, 'appointments': appointments,
+            'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed,
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'cpu_count': os.cpu_count(),
+        },
+        'seed_seconds': round(seed_seconds, 2),
+        'scenarios': {},
+    }
+
+    scenario = Scenario(app, data, rng)
+    for name in scenarios:
+        if name == 'book':
+            result['scenarios'][name] = run_booking(app, data, rng, args.requests, args.concurrency, args.hot_ratio)
+            continue
+        stats = run_latency(scenario, name, args.requests, args.warmup)
+        if args.memory_samples:
+            stats['memory'] = run_memory(scenario, name, args.memory_samples)
+        result['scenarios'][name] = stats
+
+    if args.serialization_rows:
+        result['serialization'] = run_serialization(app, args.serialization_rows)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if tmpdir:
+        with app.app_context():
+            db.engine.dispose()
+        tmpdir.cleanup()
+
+if __name__ == '__main__':
+    main()
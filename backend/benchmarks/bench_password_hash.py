@@ -0,0 +1,114 @@
+"""
+Login hash benchmark: password verifications per second through the login verifier pool.
+
+    python benchmarks/bench_password_hash.py --method scrypt:32768:8:1 --workers 4 --clients 32
+
+Verifications go through PasswordVerifier exactly as /api/auth/login does, so the
+numbers include pool admission: a client turned away with PasswordVerifierBusy is
+what the login endpoint answers with a 503. Prints JSON with single-worker
+throughput (logins/sec per core), the pool's accepted and rejected rates under
+--clients concurrent clients, accepted-login latency and the scaling factor, so hash
+cost and PASSWORD_VERIFY_WORKERS/QUEUE can be tuned against login capacity.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.passwords import DEFAULT_HASH_METHOD, DEFAULT_SALT_LENGTH, PasswordVerifier, PasswordVerifierBusy, \
+    hash_password_with
+
+RETRY_AFTER = 0.01  # Pause before a rejected client tries again (the 503's Retry-After, scaled down)
+
+def make_verifier(workers, queue, timeout):
+    app = Flask(__name__)
+    app.config.update(PASSWORD_VERIFY_WORKERS=workers, PASSWORD_VERIFY_QUEUE=queue,
+                      PASSWORD_VERIFY_TIMEOUT=timeout)
+    verifier = PasswordVerifier()
+    verifier.init_app(app)
+    return verifier
+
+def measure(verifier, stored_hash, password, seconds, clients):
+    """Runs logins for roughly `seconds` from `clients` threads. Returns counts and accepted latencies."""
+    deadline = time.perf_counter() + seconds
+    latencies, rejected = [], [0]
+    lock = threading.Lock()
+
+    def client():
+        mine, busy = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                verifier.verify(stored_hash, password)
+            except PasswordVerifierBusy:
+                busy += 1
+                time.sleep(RETRY_AFTER)
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            rejected[0] += busy
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    verifier.shutdown()
+    return {'elapsed': elapsed, 'accepted': len(latencies), 'rejected': rejected[0], 'latencies': latencies}
+
+def percentile_ms(values, q):
+    if len(values) < 2:
+        return round(values[0] * 1000, 2) if values else None
+    return round(statistics.quantiles(values, n=100)[q - 1] * 1000, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', default=os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD))
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='PASSWORD_VERIFY_WORKERS')
+    parser.add_argument('--queue', type=int, default=64, help='PASSWORD_VERIFY_QUEUE')
+    parser.add_argument('--timeout', type=float, default=10, help='PASSWORD_VERIFY_TIMEOUT')
+    parser.add_argument('--clients', type=int, help='Concurrent login clients (default: 4x workers)')
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    args = parser.parse_args()
+    clients = args.clients or args.workers * 4
+
+    password = 'correct horse battery staple'
+    started = time.perf_counter()
+    stored_hash = hash_password_with(args.method, DEFAULT_SALT_LENGTH, password)
+    hash_ms = (time.perf_counter() - started) * 1000
+
+    single = measure(make_verifier(1, 0, args.timeout), stored_hash, password, args.seconds, 1)
+    pool = measure(make_verifier(args.workers, args.queue, args.timeout), stored_hash, password, args.seconds,
+                   clients)
+    single_rate = single['accepted'] / single['elapsed']
+    accepted_rate = pool['accepted'] / pool['elapsed']
+    result = {
+        'method': args.method,
+        'hash_ms': round(hash_ms, 2),
+        'logins_per_sec_per_core': round(single_rate, 2),
+        'workers': args.workers,
+        'queue': args.queue,
+        'clients': clients,
+        'logins_per_sec_total': round(accepted_rate, 2),
+        'rejected_per_sec': round(pool['rejected'] / pool['elapsed'], 2),
+        'latency_p50_ms': percentile_ms(pool['latencies'], 50),
+        'latency_p99_ms': percentile_ms(pool['latencies'], 99),
+        'scaling': round(accepted_rate / single_rate, 2) if single_rate else None,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
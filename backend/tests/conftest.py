@@ -0,0 +1,46 @@
+import pytest
+from app import create_app, db
+from app.models import Appointment, Doctor
+from app.seed import seed_database, seed_email
+
+TEST_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'CACHE_TYPE': 'SimpleCache',
+    'SLOT_HOLD_BACKEND': 'memory',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1',
+    'TESTING': True,
+}
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app(TEST_CONFIG)
+    with app.app_context():
+        seed_database(doctors=8, patients=40, appointments=400)
+    return app
+
+@pytest.fixture(scope='module')
+def accounts(app):
+    """Ids of an approved doctor and of a patient who has completed appointments with them."""
+    with app.app_context():
+        doctor_id, patient_id = db.session.query(Appointment.doctor_id, Appointment.patient_id) \
+            .join(Doctor, Appointment.doctor_id == Doctor.id) \
+            .filter(Doctor.is_approved == True, Appointment.status == 'Completed').first()
+    return {'doctor': doctor_id, 'patient': patient_id}
+
+def login(app, email, password='password'):
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+@pytest.fixture(scope='module')
+def admin(app):
+    return login(app, 'admin@hospital.com', 'admin123')
+
+@pytest.fixture(scope='module')
+def doctor(app, accounts):
+    return login(app, seed_email('doctor', accounts['doctor']))
+
+@pytest.fixture(scope='module')
+def patient(app, accounts):
+    return login(app, seed_email('patient', accounts['patient']))
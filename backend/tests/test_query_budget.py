@@ -0,0 +1,76 @@
+"""
+Query budgets (@query_budget) are enforced under TESTING: each budgeted endpoint is
+called against a seeded database and fails with QueryBudgetExceeded if it regresses.
+"""
+import pytest
+from flask import jsonify
+from app import create_app
+from app.api.decorators import QueryBudgetExceeded, query_budget
+from app.models import User
+from app.seed import seed_email
+from conftest import TEST_CONFIG, login
+
+def _budgeted_endpoints(app):
+    return {name for name, view in app.view_functions.items() if hasattr(view, 'query_budget')}
+
+READS = {
+    'admin.dashboard': ('admin', '/admin/dashboard'),
+    'admin.get_all_doctors': ('admin', '/admin/doctors'),
+    'admin.search_doctors': ('admin', '/admin/doctors/search?q=cardio'),
+    'admin.get_all_patients': ('admin', '/admin/patients'),
+    'admin.search_patients': ('admin', '/admin/patients/search?q=smith'),
+    'admin.get_patient_history': ('admin', '/admin/patients/{patient}/history'),
+    'admin.view_all_appointments': ('admin', '/admin/appointments?limit=50'),
+    'doctor.dashboard': ('doctor', '/doctor/dashboard'),
+    'doctor.get_patient_history': ('doctor', '/doctor/patient/{patient}/history'),
+    'doctor.search_treatments_view': ('doctor', '/doctor/treatments/search?q=pain'),
+    'patient.get_doctors': ('patient', '/patient/doctors'),
+    'patient.search_doctors': ('patient', '/patient/doctors/search?q=cardio'),
+    'patient.get_doctor_slots': ('patient', '/patient/doctors/{doctor}/slots'),
+    'patient.get_department_slots': ('patient', '/patient/departments/1/slots'),
+    'patient.dashboard': ('patient', '/patient/dashboard'),
+    'patient.history': ('patient', '/patient/history'),
+}
+WRITES = {'patient.book_appointment', 'patient.join_waitlist'}
+
+def test_every_budgeted_endpoint_is_covered(app):
+    assert _budgeted_endpoints(app) == set(READS) | WRITES
+
+@pytest.mark.parametrize('endpoint', sorted(READS))
+def test_read_endpoint_within_budget(request, app, accounts, endpoint):
+    role, path = READS[endpoint]
+    client = request.getfixturevalue(role)
+    response = client.get(path.format(**accounts))
+    assert response.status_code == 200, response.get_json()
+
+def test_booking_and_waitlist_within_budget(app, accounts, patient):
+    slots = patient.get(f"/patient/doctors/{accounts['doctor']}/slots").get_json()
+    day, labels = next(iter(slots['slots'].items()))
+    slot = {'doctor_id': accounts['doctor'], 'date': day, 'time_slot': labels[0]}
+
+    response = patient.post('/patient/book', json=slot)
+    assert response.status_code == 201, response.get_json()
+
+    other = login(app, seed_email('patient', accounts['patient'] % 40 + 1))
+    response = other.post('/patient/waitlist', json=slot)
+    assert response.status_code in (200, 201), response.get_json()
+
+def _probe_app(**config):
+    app = create_app({**TEST_CONFIG, **config})
+
+    @app.route('/budget-probe')
+    @query_budget(1)
+    def budget_probe():
+        User.query.count()
+        User.query.count()
+        return jsonify({})
+    return app
+
+def test_exceeding_the_budget_raises():
+    app = _probe_app()
+    with pytest.raises(QueryBudgetExceeded, match='issued 2 queries'):
+        app.test_client().get('/budget-probe')
+
+def test_budget_not_enforced_when_disabled():
+    app = _probe_app(QUERY_BUDGET_ENFORCED=False)
+    assert app.test_client().get('/budget-probe').status_code == 200
@@ -19,4 +19,18 @@ api.interceptors.response.use(
   }
 );
 
+/**
+ * Fetches several GET endpoints in one round trip (POST /auth/bundle).
+ * Resolves to the response bodies in the order of `paths`; rejects if any part failed.
+ */
+export const fetchBundle = async (paths) => {
+  const res = await api.post('/auth/bundle', { requests: paths });
+  return res.data.responses.map(part => {
+    if (part.status >= 400) {
+      throw Object.assign(new Error(`${part.path} failed with ${part.status}`), { response: { status: part.status, data: part.body } });
+    }
+    return part.body;
+  });
+};
+
 export default api;
\ No newline at end of file